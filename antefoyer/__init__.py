@@ -3,12 +3,51 @@ antefoyer
 A simple antechamber plugin for foyer
 """
 
-# Add imports here
-from .antefoyer import *
-
-# Handle versioneer
-from ._version import get_versions
-versions = get_versions()
-__version__ = versions['version']
-__git_revision__ = versions['full-revisionid']
-del get_versions, versions
+# The package is imported lazily: parmed, foyer and friends are only
+# loaded when the API is first used, and the version only when asked
+# for (versioneer may run git in a source checkout).
+import importlib
+
+_SUBMODULES = ("antefoyer", "exceptions", "gafffoyer", "utils")
+
+# Public names of the antefoyer.antefoyer module, forwarded on access
+__all__ = [
+    "ANTECHAMBER",
+    "ante_atomtyping",
+    "ante_atomtyping_async",
+    "ante_atomtyping_batch",
+    "ante_atomtyping_stream",
+    "ante_charges",
+    "ante_charges_async",
+    "ante_charges_batch",
+    "ante_charges_conformers",
+    "ante_charges_stream",
+    "ante_parametrize",
+]
+
+
+def __getattr__(name):
+    if name in ("__version__", "__git_revision__"):
+        from ._version import get_versions
+
+        versions = get_versions()
+        globals()["__version__"] = versions["version"]
+        globals()["__git_revision__"] = versions["full-revisionid"]
+        return globals()[name]
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    if not name.startswith("_"):
+        # Not cached here, so that values the module rebinds (e.g.,
+        # ANTECHAMBER) stay current
+        module = importlib.import_module(".antefoyer", __name__)
+        try:
+            return getattr(module, name)
+        except AttributeError:
+            pass
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    module = importlib.import_module(".antefoyer", __name__)
+    public = [name for name in dir(module) if not name.startswith("_")]
+    return sorted(set(globals()) | set(public) | set(_SUBMODULES))
@@ -1,24 +1,74 @@
 from __future__ import division
 
+import asyncio
 import os
+import re
+import shutil
+import signal
 import sys
+import tempfile
+import threading
+import time
 import warnings
+import weakref
 
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from functools import partial
+
+import numpy as np
 import parmed as pmd
-import networkx as nx
+from parmed.periodic_table import AtomicNum, element_by_name
+
+from subprocess import PIPE, Popen, TimeoutExpired
+from antefoyer.exceptions import AntechamberCancelledError
+from antefoyer.exceptions import AntechamberTimeoutError
+from antefoyer.utils.tempdir import get_scratch_config, scratch_directory
+from antefoyer.utils.tempdir import set_scratch_config
+from antefoyer.utils.cache import cache_key, get_cache_dir
+from antefoyer.utils.cache import load_cached, store_cached
+from antefoyer.utils.cache import load_metadata, store_metadata
+from antefoyer.utils.graph import bond_array, component_atoms
+from antefoyer.utils.graph import component_bonds, connected_components
+from antefoyer.utils.fragment import capped_fragment, partition, repeat_units
+from antefoyer.utils.manifest import append_manifest, open_manifest, read_manifest
+from antefoyer.utils.mol2 import read_ac_atoms, read_mol2_atoms
+from antefoyer.utils.molfile import iter_molecules, write_mol2_record
+from antefoyer.utils.schedule import estimate_costs, load_timings
+from antefoyer.utils.schedule import lpt_chunks, record_timings
+from antefoyer.utils.timing import add_timing_callback, remove_timing_callback, timed
 
-from distutils.spawn import find_executable
-from subprocess import PIPE, Popen
-from antefoyer.utils.tempdir import temporary_directory
-from antefoyer.utils.tempdir import temporary_cd
+# Environment variable with the path of the antechamber executable
+ANTECHAMBER_ENV = "ANTEFOYER_ANTECHAMBER"
 
-from foyer.exceptions import FoyerError
-from foyer.utils.io import import_, has_mbuild
+# Maximum number of antechamber runs in flight per event loop
+# in the asyncio API. None uses the number of CPUs.
+ASYNC_CONCURRENCY = None
+_ASYNC_SEMAPHORES = weakref.WeakKeyDictionary()
 
-ANTECHAMBER = find_executable("antechamber")
+# Seconds between checks for cancellation while antechamber runs
+_POLL_INTERVAL = 0.1
+# Seconds to wait for a killed asyncio subprocess to be reaped
+_REAP_TIMEOUT = 5.0
 
+# Charge styles derived from one AM1 calculation by sqm
+_AM1_CHARGE_STYLES = ("bcc", "mul")
 
-def ante_atomtyping(molecule, atype_style):
+
+@timed("ante_atomtyping")
+def ante_atomtyping(
+    molecule,
+    atype_style,
+    cache_dir=None,
+    system=False,
+    template=False,
+    input_format="pdb",
+    trust_bond_orders=False,
+    return_structure=True,
+    timeout=None,
+    cancel=None,
+):
     """Perform atomtyping by calling antechamber
 
     Parameters
@@ -28,227 +78,2154 @@ def ante_atomtyping(molecule, atype_style):
     atype_style : str
         Style of atomtyping. Options include 'gaff', 'gaff2',
         'amber', 'bcc', 'sybyl'.
+    cache_dir : str or bool, optional, default=None
+        Directory of the on-disk result cache. If None, the
+        ANTEFOYER_CACHE_DIR environment variable is used. Results are
+        keyed by the molecular graph and `atype_style`. Pass False
+        to disable caching.
+    system : bool, optional, default=False
+        Treat the structure as a system of one or more molecules.
+        Each unique species is typed once and the atom types are
+        copied to every molecule of that species.
+    template : bool, optional, default=False
+        Type a polymer or other molecule built from repeat units by
+        typing one representative of each unit. The units are the
+        residues of the structure; the children of an
+        mbuild.Compound become residues. Each unique unit, with its
+        bonds to neighboring units capped by hydrogens, is typed once
+        and the atom types are copied to every copy of the unit. End
+        groups are units of their own.
+    input_format : str, optional, default='pdb'
+        Format of the antechamber input file, 'pdb' or 'mol2'. Only
+        the mol2 file carries the bond orders of the structure.
+    trust_bond_orders : bool, optional, default=False
+        Use the bond orders of the structure (`bond.order`) as they
+        are and skip antechamber's bond order perception. Requires
+        `input_format='mol2'`.
+    return_structure : bool, optional, default=True
+        Return a parmed.Structure. If False, only the atom types are
+        read from the antechamber output and returned as an array,
+        which is considerably cheaper.
+    timeout : float, optional, default=None
+        Maximum time in seconds for the call. When it is exceeded,
+        antechamber and its child processes (e.g., sqm) are killed and
+        AntechamberTimeoutError is raised.
+    cancel : threading.Event, optional, default=None
+        Event another thread can set to cancel the call. Antechamber
+        and its child processes are then killed and
+        AntechamberCancelledError is raised.
 
     Returns
     -------
-    typed_molecule : parmed.Structure
-        The molecule with antechamber atomtyping applied
+    typed_molecule : parmed.Structure or np.ndarray of str
+        A copy of the input structure with the antechamber atom types
+        set. If `return_structure` is False, the atom types in atom
+        order.
     """
-    _check_antechamber(ANTECHAMBER)
+    steps = _atomtyping_steps(
+        molecule,
+        atype_style,
+        cache_dir=cache_dir,
+        system=system,
+        template=template,
+        input_format=input_format,
+        trust_bond_orders=trust_bond_orders,
+        return_structure=return_structure,
+    )
+    return _run_steps(steps, timeout=timeout, cancel=cancel)
 
-    # Check valid atomtype name
-    supported_atomtypes = ["gaff", "gaff2", "amber", "bcc", "sybyl"]
-    if atype_style not in supported_atomtypes:
-        raise FoyerError(
-            "Unsupported atomtyping style requested. "
-            "Please select from {}".format(supported_atomtypes)
-        )
 
-    # Check for parmed.Structure. Convert from mbuild.Compound if possible
-    molecule = _check_structure(molecule)
-    # Confirm single connected molecule
-    _check_single_molecule(molecule)
+@timed("ante_charges")
+def ante_charges(
+    molecule,
+    charge_style,
+    net_charge=0.0,
+    multiplicity=1,
+    charge_tol=0.005,
+    cache_dir=None,
+    system=False,
+    template=False,
+    input_format="pdb",
+    trust_bond_orders=False,
+    return_structure=True,
+    timeout=None,
+    cancel=None,
+    fragment_size=None,
+):
+    """Calculates partial charges by calling antechamber
 
-    # Get current directory to write any error logs
-    workdir = os.getcwd()
-    # Work within a temporary directory
-    # to clean up after antechamber
-    with temporary_directory() as tmpdir:
-        with temporary_cd(tmpdir):
-            # Save the existing molecule to file
-            _write_pdb(molecule, "ante_in.pdb")
-            # Call antechamber
-            command = (
-                "antechamber -i ante_in.pdb -fi pdb "
-                "-o ante_out.mol2 -fo mol2 " + "-at " + atype_style + " " + "-s 2"
-            )
+    Parameters
+    ----------
+    molecule : parmed.Structure or mbuild.Compound
+        Molecular structure to perform atomtyping on
+    charge_style : str
+        Style of partial charges calculation. Options include
+        'bcc', 'gas', and 'mul'. See antechamber documentation
+        by running 'antechamber -L' for details.
+    net_charge : float, optional, default=0.0
+        Net charge of the molecule
+    multiplicity : int, optional, default=1
+        Spin multiplicity, 2S + 1
+    charge_tol : float, optional, default=0.005
+        Maximum allowed deviation between the sum of the charges
+        from antechamber and the requested net charge
+    cache_dir : str or bool, optional, default=None
+        Directory of the on-disk result cache. If None, the
+        ANTEFOYER_CACHE_DIR environment variable is used. Results are
+        keyed by the molecular graph, the coordinates, the charge
+        settings and the antechamber version. Pass False to disable
+        caching. The AM1 calculation behind 'bcc' and 'mul' charges
+        is cached on its own, so a later request for the other of
+        these styles does not run sqm again.
+    system : bool, optional, default=False
+        Treat the structure as a system of one or more molecules.
+        Each unique species is charged once and the charges are
+        copied to every molecule of that species. `net_charge` and
+        `multiplicity` then apply to each species. They may also be
+        given as a dict keyed by the chemical formula of the species
+        (e.g., {'C2H6': 0.0, 'C2H3O2': -1.0}).
+    template : bool, optional, default=False
+        Charge a molecule built from repeat units by charging one
+        representative of each unit. See `ante_atomtyping`. The
+        charge of each hydrogen cap is added to the atom it is
+        bonded to. The net charge of each unit is the sum of the
+        formal charges of its atoms (`atom.formal_charge`), which
+        must add up to `net_charge`.
+    input_format : str, optional, default='pdb'
+        Format of the antechamber input file, 'pdb' or 'mol2'. Only
+        the mol2 file carries the bond orders of the structure.
+    trust_bond_orders : bool, optional, default=False
+        Use the bond orders of the structure (`bond.order`) as they
+        are and skip antechamber's bond order perception. Requires
+        `input_format='mol2'`.
+    return_structure : bool, optional, default=True
+        Apply the charges to the molecule and return it. If False,
+        the molecule is left unchanged and only the charges are
+        returned.
+    timeout : float, optional, default=None
+        Maximum time in seconds for the call. When it is exceeded,
+        antechamber and its child processes (e.g., sqm) are killed and
+        AntechamberTimeoutError is raised.
+    cancel : threading.Event, optional, default=None
+        Event another thread can set to cancel the call. Antechamber
+        and its child processes are then killed and
+        AntechamberCancelledError is raised.
+    fragment_size : int, optional, default=None
+        Charge large molecules fragment by fragment. The molecule is
+        cut at rotatable single bonds into fragments of at most this
+        many atoms, each cut is capped with a hydrogen and the
+        fragments are charged in parallel. The charge of each cap is
+        added to the atom it is bonded to. The net charge of each
+        fragment is the sum of the formal charges of its atoms
+        (`atom.formal_charge`), which must add up to `net_charge`.
+        Only supported for single, closed-shell molecules.
 
-            proc = Popen(
-                command, stdout=PIPE, stderr=PIPE, universal_newlines=True, shell=True
+    Returns
+    -------
+    molecule : parmed.Structure or np.ndarray of float
+        The molecule with charges applied. If `return_structure` is
+        False, the partial charges in atom order.
+    """
+    if fragment_size is not None:
+        if system or template:
+            raise ValueError(
+                "fragment_size cannot be combined with system or template"
             )
+        return _fragment_charges(
+            molecule,
+            charge_style,
+            net_charge,
+            multiplicity,
+            charge_tol,
+            fragment_size,
+            cache_dir=cache_dir,
+            input_format=input_format,
+            trust_bond_orders=trust_bond_orders,
+            return_structure=return_structure,
+            timeout=timeout,
+            cancel=cancel,
+        )
+    steps = _charges_steps(
+        molecule,
+        charge_style,
+        net_charge=net_charge,
+        multiplicity=multiplicity,
+        charge_tol=charge_tol,
+        cache_dir=cache_dir,
+        system=system,
+        template=template,
+        input_format=input_format,
+        trust_bond_orders=trust_bond_orders,
+        return_structure=return_structure,
+    )
+    return _run_steps(steps, timeout=timeout, cancel=cancel)
 
-            out, err = proc.communicate()
 
-            # Error handling here
-            if "Fatal Error" in err or proc.returncode != 0:
-                _antechamber_error(out, err, workdir)
+@timed("ante_parametrize")
+def ante_parametrize(
+    molecule,
+    atype_style,
+    charge_style,
+    net_charge=0.0,
+    multiplicity=1,
+    charge_tol=0.005,
+    cache_dir=None,
+    system=False,
+    template=False,
+    input_format="pdb",
+    trust_bond_orders=False,
+    return_structure=True,
+    timeout=None,
+    cancel=None,
+):
+    """Perform atomtyping and calculate partial charges with a
+    single call to antechamber
 
-            # Now read in the mol2 file with atomtyping
-            typed_molecule = pmd.load_file("ante_out.mol2", structure=True)
+    This is equivalent to calling `ante_atomtyping` followed by
+    `ante_charges`, but the input file is written, antechamber is run
+    and its output is read only once.
 
-    # Foyer requires that the atom type info is stored under atom.id
-    for atom in typed_molecule:
-        atom.id = atom.type
+    Parameters
+    ----------
+    molecule : parmed.Structure or mbuild.Compound
+        Molecular structure to parametrize
+    atype_style : str
+        Style of atomtyping. Options include 'gaff', 'gaff2',
+        'amber', 'bcc', 'sybyl'.
+    charge_style : str
+        Style of partial charges calculation. Options include
+        'bcc', 'gas', and 'mul'.
+    net_charge : float, optional, default=0.0
+        Net charge of the molecule
+    multiplicity : int, optional, default=1
+        Spin multiplicity, 2S + 1
+    charge_tol : float, optional, default=0.005
+        Maximum allowed deviation between the sum of the charges
+        from antechamber and the requested net charge
+    cache_dir : str or bool, optional, default=None
+        Directory of the on-disk result cache. See `ante_charges`.
+    system : bool, optional, default=False
+        Treat the structure as a system of one or more molecules.
+        See `ante_charges`.
+    template : bool, optional, default=False
+        Parametrize one representative of each repeat unit. See
+        `ante_atomtyping` and `ante_charges`.
+    input_format : str, optional, default='pdb'
+        Format of the antechamber input file, 'pdb' or 'mol2'.
+    trust_bond_orders : bool, optional, default=False
+        Skip antechamber's bond order perception. Requires
+        `input_format='mol2'`.
+    return_structure : bool, optional, default=True
+        Return a parmed.Structure. If False, return arrays of the
+        atom types and charges instead.
+    timeout : float, optional, default=None
+        Maximum time in seconds for the call. See `ante_atomtyping`.
+    cancel : threading.Event, optional, default=None
+        Event another thread can set to cancel the call.
 
-    # And return it
-    return typed_molecule
+    Returns
+    -------
+    typed_molecule : parmed.Structure or tuple of np.ndarray
+        A copy of the molecule with antechamber atomtyping and charges
+        applied. If `return_structure` is False, the atom types and the
+        partial charges in atom order.
+    """
+    steps = _parametrize_steps(
+        molecule,
+        atype_style,
+        charge_style,
+        net_charge=net_charge,
+        multiplicity=multiplicity,
+        charge_tol=charge_tol,
+        cache_dir=cache_dir,
+        system=system,
+        template=template,
+        input_format=input_format,
+        trust_bond_orders=trust_bond_orders,
+        return_structure=return_structure,
+    )
+    return _run_steps(steps, timeout=timeout, cancel=cancel)
 
 
-def ante_charges(
-    molecule, charge_style, net_charge=0.0, multiplicity=1, charge_tol=0.005
+def ante_atomtyping_batch(
+    molecules,
+    atype_style,
+    n_procs=None,
+    use_threads=False,
+    return_exceptions=False,
+    **kwargs
 ):
-    """Calculates partial charges by calling antechamber
+    """Perform atomtyping on many molecules in parallel
+
+    Each molecule is typed by a separate antechamber run. The runs
+    are distributed over a pool of worker processes or threads.
 
     Parameters
     ----------
-    molecule : parmed.Structure or mbuild.Compound
-        Molecular structure to perform atomtyping on
+    molecules : iterable of parmed.Structure or mbuild.Compound
+        Molecular structures to perform atomtyping on
+    atype_style : str
+        Style of atomtyping. Options include 'gaff', 'gaff2',
+        'amber', 'bcc', 'sybyl'.
+    n_procs : int, optional, default=None
+        Number of worker processes. Defaults to the number of
+        CPUs available on the machine.
+    use_threads : bool, optional, default=False
+        Use a pool of threads instead of processes. The work is done
+        by the antechamber subprocesses, so threads avoid the cost of
+        starting workers and of sending structures between them.
+    return_exceptions : bool, optional, default=False
+        Return the exception raised for a molecule in place of its
+        result instead of raising it. Combined with `timeout`, this
+        lets a batch finish even when a few molecules fail.
+    **kwargs
+        Additional keyword arguments (e.g., `cache_dir`, `timeout`) are passed
+        to `ante_atomtyping`.
+
+    Returns
+    -------
+    typed_molecules : list of parmed.Structure
+        The molecules with antechamber atomtyping applied, in the
+        same order as `molecules`
+    """
+    _check_antechamber(_antechamber())
+    _check_atype_style(atype_style)
+
+    template = kwargs.get("template", False)
+    molecules = [_check_structure(molecule, template) for molecule in molecules]
+    jobs = [(molecule, atype_style) for molecule in molecules]
+
+    function = partial(ante_atomtyping, **kwargs)
+    return _run_batch(function, jobs, n_procs, use_threads, return_exceptions)
+
+
+def ante_charges_batch(
+    molecules,
+    charge_style,
+    net_charge=0.0,
+    multiplicity=1,
+    charge_tol=0.005,
+    n_procs=None,
+    use_threads=False,
+    return_exceptions=False,
+    schedule=True,
+    manifest=None,
+    **kwargs
+):
+    """Calculate partial charges for many molecules in parallel
+
+    Each molecule is charged by a separate antechamber run. The runs
+    are distributed over a pool of worker processes or threads.
+
+    Parameters
+    ----------
+    molecules : iterable of parmed.Structure or mbuild.Compound
+        Molecular structures to calculate partial charges for
     charge_style : str
         Style of partial charges calculation. Options include
         'bcc', 'gas', and 'mul'. See antechamber documentation
         by running 'antechamber -L' for details.
+    net_charge : float or sequence of float, optional, default=0.0
+        Net charge of the molecules. Either a single value applied
+        to every molecule or one value per molecule.
+    multiplicity : int or sequence of int, optional, default=1
+        Spin multiplicity, 2S + 1. Either a single value applied
+        to every molecule or one value per molecule.
+    charge_tol : float, optional, default=0.005
+        Maximum allowed deviation between the sum of the charges
+        from antechamber and the requested net charge
+    n_procs : int, optional, default=None
+        Number of worker processes. Defaults to the number of
+        CPUs available on the machine.
+    use_threads : bool, optional, default=False
+        Use a pool of threads instead of processes. The work is done
+        by the antechamber subprocesses, so threads avoid the cost of
+        starting workers and of sending structures between them.
+    return_exceptions : bool, optional, default=False
+        Return the exception raised for a molecule in place of its
+        result instead of raising it. Combined with `timeout`, this
+        lets a batch finish even when a few molecules fail.
+    schedule : bool, optional, default=True
+        Start the molecules expected to take longest first and run
+        small molecules in chunks, so that no worker is left with a
+        large molecule at the end of the batch. The cost of each
+        molecule is estimated from its number of atoms and heavy
+        atoms and the charge style, fit to the antechamber timings
+        of earlier batches. Timings are stored in the cache
+        directory if one is configured, and otherwise kept for the
+        lifetime of the process.
+    manifest : str, optional, default=None
+        Path of a manifest file that makes the batch resumable. The
+        charges of each molecule are appended to the manifest as soon
+        as the molecule is done. When the batch is run again with the
+        same manifest, molecules found in it are not charged again
+        but get the recorded charges. Molecules are matched by their
+        structure, coordinates, charge settings (including
+        `charge_tol`) and the antechamber version, not by position.
+    **kwargs
+        Additional keyword arguments (e.g., `cache_dir`, `timeout`) are passed
+        to `ante_charges`.
+
+    Returns
+    -------
+    molecules : list of parmed.Structure
+        The molecules with charges applied, in the same order as
+        `molecules`. When more than one worker process is used the
+        returned structures are copies of the input structures.
+        Otherwise, the input structures are modified in place.
+    """
+    _check_antechamber(_antechamber())
+    _check_charge_style(charge_style)
+
+    template = kwargs.get("template", False)
+    molecules = [_check_structure(molecule, template) for molecule in molecules]
+    net_charges = _per_molecule(net_charge, len(molecules), "net_charge")
+    multiplicities = _per_molecule(multiplicity, len(molecules), "multiplicity")
+    jobs = [
+        (molecule, charge_style, nc, mult, charge_tol)
+        for molecule, nc, mult in zip(molecules, net_charges, multiplicities)
+    ]
+
+    results = [None] * len(jobs)
+    pending = list(range(len(jobs)))
+    keys = None
+    if manifest is not None:
+        version = _antechamber_version(get_cache_dir(kwargs.get("cache_dir")))
+        keys = [
+            _manifest_key(molecule, charge_style, nc, mult, charge_tol, version, kwargs)
+            for molecule, nc, mult in zip(molecules, net_charges, multiplicities)
+        ]
+        completed = read_manifest(manifest)
+        pending = []
+        for idx, key in enumerate(keys):
+            if key in completed:
+                results[idx] = _restore_charges(
+                    molecules[idx],
+                    completed[key],
+                    kwargs.get("return_structure", True),
+                )
+            else:
+                pending.append(idx)
+
+    function = partial(ante_charges, **kwargs)
+    costs = None
+    if schedule:
+        cache_dir = get_cache_dir(kwargs.get("cache_dir"))
+        timings = load_timings(cache_dir)
+        n_atoms = [len(molecules[idx].atoms) for idx in pending]
+        n_heavy = [
+            sum(1 for atom in molecules[idx].atoms if atom.element > 1)
+            for idx in pending
+        ]
+        costs = estimate_costs(timings, charge_style, n_atoms, n_heavy)
+        function = partial(_call_timed, function)
+
+    runs = []
+    manifest_file = None if manifest is None else open_manifest(manifest)
+
+    def on_result(pending_idx, result):
+        idx = pending[pending_idx]
+        if isinstance(result, Exception):
+            results[idx] = result
+            return
+        if schedule:
+            result, seconds = result
+            if seconds is not None:
+                runs.append((n_atoms[pending_idx], n_heavy[pending_idx], seconds))
+        results[idx] = result
+        if manifest_file is not None:
+            append_manifest(manifest_file, keys[idx], idx, _result_charges(result))
+
+    try:
+        _run_batch(
+            function,
+            [jobs[idx] for idx in pending],
+            n_procs,
+            use_threads,
+            return_exceptions,
+            costs=costs,
+            on_result=on_result,
+        )
+    finally:
+        if manifest_file is not None:
+            manifest_file.close()
+        if schedule:
+            record_timings(timings, charge_style, runs, cache_dir)
+    return results
+
+
+def ante_atomtyping_stream(
+    filename,
+    atype_style,
+    input_format=None,
+    output=None,
+    n_procs=None,
+    use_threads=False,
+    window=None,
+    ordered=False,
+    return_exceptions=False,
+    **kwargs
+):
+    """Perform atomtyping on the molecules of a multi-record file
+
+    Molecules are read from the file one at a time and typed by
+    a pool of worker processes or threads, with at most `window`
+    molecules read but not yet returned. Memory use therefore does
+    not grow with the size of the file.
+
+    Parameters
+    ----------
+    filename : str
+        SDF (.sdf, .sd, .mol) or mol2 file with one or more molecules
+    atype_style : str
+        Style of atomtyping. Options include 'gaff', 'gaff2',
+        'amber', 'bcc', 'sybyl'.
+    input_format : str, optional, default=None
+        Format of the file, 'sdf' or 'mol2'. If None, the format is
+        taken from the file extension.
+    output : str, optional, default=None
+        Path of a mol2 file to write the typed molecules to as they
+        are done, each record named as in `filename`. See Returns.
+    n_procs : int, optional, default=None
+        Number of worker processes. Defaults to the number of
+        CPUs available on the machine.
+    use_threads : bool, optional, default=False
+        Use a pool of threads instead of processes
+    window : int, optional, default=None
+        Maximum number of molecules in flight. Defaults to twice
+        `n_procs`.
+    ordered : bool, optional, default=False
+        Return the molecules in file order. Otherwise they are
+        returned as soon as they are done. Molecules waiting for an
+        earlier one count towards `window`.
+    return_exceptions : bool, optional, default=False
+        Return the exception raised for a molecule in place of its
+        result instead of raising it. With `output`, failed molecules
+        are skipped with a warning.
+    **kwargs
+        Additional keyword arguments (e.g., `cache_dir`, `timeout`) are passed
+        to `ante_atomtyping`.
+
+    Returns
+    -------
+    results : generator of (int, parmed.Structure)
+        Index in the file and typed molecule of each molecule. If
+        `output` is given, the molecules are written to it instead
+        and the number of molecules written is returned.
+    """
+    _check_antechamber(_antechamber())
+    _check_atype_style(atype_style)
+    _check_stream_output(output, kwargs)
+
+    jobs = (
+        (molecule, atype_style)
+        for molecule in iter_molecules(filename, input_format)
+    )
+    results = _run_stream(
+        partial(_keep_title, partial(ante_atomtyping, **kwargs)),
+        jobs,
+        n_procs,
+        use_threads,
+        window,
+        ordered,
+        return_exceptions,
+    )
+    if output is None:
+        return results
+    return _write_stream(results, output)
+
+
+def ante_charges_stream(
+    filename,
+    charge_style,
+    net_charge=None,
+    multiplicity=1,
+    charge_tol=0.005,
+    input_format=None,
+    output=None,
+    n_procs=None,
+    use_threads=False,
+    window=None,
+    ordered=False,
+    return_exceptions=False,
+    **kwargs
+):
+    """Calculate partial charges for the molecules of a multi-record file
+
+    Molecules are read from the file one at a time and charged by
+    a pool of worker processes or threads, with at most `window`
+    molecules read but not yet returned. Memory use therefore does
+    not grow with the size of the file.
+
+    Parameters
+    ----------
+    filename : str
+        SDF (.sdf, .sd, .mol) or mol2 file with one or more molecules
+    charge_style : str
+        Style of partial charges calculation. Options include
+        'bcc', 'gas', and 'mul'. See antechamber documentation
+        by running 'antechamber -L' for details.
+    net_charge : float, optional, default=None
+        Net charge of every molecule. If None, the net charge of
+        each molecule is the sum of the formal charges of its atoms,
+        which are read from SDF files and zero for mol2 files.
+    multiplicity : int, optional, default=1
+        Spin multiplicity, 2S + 1
+    charge_tol : float, optional, default=0.005
+        Maximum allowed deviation between the sum of the charges
+        from antechamber and the requested net charge
+    input_format : str, optional, default=None
+        Format of the file, 'sdf' or 'mol2'. If None, the format is
+        taken from the file extension.
+    output : str, optional, default=None
+        Path of a mol2 file to write the charged molecules to as
+        they are done, each record named as in `filename`. See
+        Returns.
+    n_procs : int, optional, default=None
+        Number of worker processes. Defaults to the number of
+        CPUs available on the machine.
+    use_threads : bool, optional, default=False
+        Use a pool of threads instead of processes
+    window : int, optional, default=None
+        Maximum number of molecules in flight. Defaults to twice
+        `n_procs`.
+    ordered : bool, optional, default=False
+        Return the molecules in file order. Otherwise they are
+        returned as soon as they are done. Molecules waiting for an
+        earlier one count towards `window`.
+    return_exceptions : bool, optional, default=False
+        Return the exception raised for a molecule in place of its
+        result instead of raising it. With `output`, failed molecules
+        are skipped with a warning.
+    **kwargs
+        Additional keyword arguments (e.g., `cache_dir`, `timeout`) are passed
+        to `ante_charges`.
+
+    Returns
+    -------
+    results : generator of (int, parmed.Structure)
+        Index in the file and charged molecule of each molecule. If
+        `output` is given, the molecules are written to it instead
+        and the number of molecules written is returned.
+    """
+    _check_antechamber(_antechamber())
+    _check_charge_style(charge_style)
+    _check_stream_output(output, kwargs)
+
+    jobs = (
+        (
+            molecule,
+            charge_style,
+            _formal_net_charge(molecule) if net_charge is None else net_charge,
+            multiplicity,
+            charge_tol,
+        )
+        for molecule in iter_molecules(filename, input_format)
+    )
+    results = _run_stream(
+        partial(_keep_title, partial(ante_charges, **kwargs)),
+        jobs,
+        n_procs,
+        use_threads,
+        window,
+        ordered,
+        return_exceptions,
+    )
+    if output is None:
+        return results
+    return _write_stream(results, output)
+
+
+def ante_charges_conformers(
+    molecule,
+    charge_style,
+    coordinates=None,
+    net_charge=0.0,
+    multiplicity=1,
+    charge_tol=0.005,
+    n_procs=None,
+    timeout=None,
+    cancel=None,
+    **kwargs
+):
+    """Calculate partial charges averaged over several conformers
+
+    Each conformer is charged by a separate antechamber run. The runs
+    share one topology and are distributed over a pool of threads.
+
+    Parameters
+    ----------
+    molecule : parmed.Structure or mbuild.Compound
+        Molecular structure to calculate partial charges for
+    charge_style : str
+        Style of partial charges calculation. Options include
+        'bcc', 'gas', and 'mul'.
+    coordinates : array-like of float, shape=(n_conformers, n_atoms, 3), optional
+        Coordinates of the conformers in Angstrom. If None, all
+        coordinate frames of the structure are used.
     net_charge : float, optional, default=0.0
         Net charge of the molecule
     multiplicity : int, optional, default=1
         Spin multiplicity, 2S + 1
+    charge_tol : float, optional, default=0.005
+        Maximum allowed deviation between the sum of the averaged
+        charges and the requested net charge
+    n_procs : int, optional, default=None
+        Number of conformers charged at once. Defaults to the number
+        of CPUs available on the machine.
+    timeout : float, optional, default=None
+        Maximum time in seconds for all conformers together.
+    cancel : threading.Event, optional, default=None
+        Event another thread can set to cancel the call.
+    **kwargs
+        `cache_dir`, `input_format` and `trust_bond_orders` are the
+        same as for `ante_charges`. `system`, `template`,
+        `fragment_size` and `return_structure` are not supported, nor
+        is `correct_net_charge`: the charges are always returned as
+        arrays and only their average is corrected.
+
+    Returns
+    -------
+    charges : np.ndarray of float, shape=(n_atoms,)
+        Partial charges averaged over the conformers. The net charge
+        correction is applied to the average only.
+    conformer_charges : np.ndarray of float, shape=(n_conformers, n_atoms)
+        Partial charges of each conformer, as computed by antechamber
+    """
+    _check_antechamber(_antechamber())
+    _check_charge_style(charge_style)
+    for name in ("system", "template", "fragment_size"):
+        if kwargs.pop(name, None):
+            raise ValueError(
+                "{} is not supported by ante_charges_conformers".format(name)
+            )
+    for name in ("return_structure", "correct_net_charge"):
+        if name in kwargs:
+            raise ValueError(
+                "{} cannot be set for ante_charges_conformers, which returns "
+                "arrays of charges and corrects only their average".format(name)
+            )
+    molecule = _check_structure(molecule)
+    _check_single_molecule(molecule)
+
+    if coordinates is None:
+        coordinates = molecule.get_coordinates("all")
+    coordinates = np.asarray(coordinates, dtype=float)
+    if coordinates.ndim != 3 or coordinates.shape[1:] != (len(molecule.atoms), 3):
+        raise ValueError(
+            "coordinates must have shape (n_conformers, {}, 3), "
+            "not {}".format(len(molecule.atoms), coordinates.shape)
+        )
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    jobs = [
+        (molecule, conformer, charge_style, net_charge, multiplicity, deadline, cancel)
+        for conformer in coordinates
+    ]
+    function = partial(_charge_conformer, **kwargs)
+    conformer_charges = np.array(
+        _run_batch(function, jobs, n_procs, use_threads=True)
+    ).reshape(len(coordinates), len(molecule.atoms))
+
+    charges = _correct_net_charge(conformer_charges.mean(axis=0), net_charge, charge_tol)
+    return charges, conformer_charges
+
+
+async def ante_atomtyping_async(
+    molecule, atype_style, semaphore=None, timeout=None, **kwargs
+):
+    """Perform atomtyping by calling antechamber without blocking
+    the event loop
+
+    Antechamber is run as an asyncio subprocess and the file I/O
+    around it in the default executor of the event loop. At most
+    `ASYNC_CONCURRENCY` runs are in flight at once unless a different
+    semaphore is given. If the task is cancelled, antechamber and its
+    child processes are killed.
+
+    Parameters
+    ----------
+    molecule : parmed.Structure or mbuild.Compound
+        Molecular structure to perform atomtyping on
+    atype_style : str
+        Style of atomtyping. Options include 'gaff', 'gaff2',
+        'amber', 'bcc', 'sybyl'.
+    semaphore : asyncio.Semaphore, optional, default=None
+        Semaphore bounding the number of concurrent antechamber runs.
+        Defaults to a semaphore shared by all calls on the event loop.
+    timeout : float, optional, default=None
+        Maximum time in seconds for the call, excluding time spent
+        waiting for the semaphore. See `ante_atomtyping`.
+    **kwargs
+        Additional keyword arguments are the same as for
+        `ante_atomtyping`.
 
     Returns
     -------
-    molecule : parmed.Structure
-        The molecule with charges applied
+    typed_molecule : parmed.Structure or np.ndarray of str
+        See `ante_atomtyping`
     """
-    _check_antechamber(ANTECHAMBER)
+    steps = _atomtyping_steps(molecule, atype_style, **kwargs)
+    return await _run_steps_async(steps, semaphore, timeout)
+
+
+async def ante_charges_async(
+    molecule, charge_style, semaphore=None, timeout=None, **kwargs
+):
+    """Calculate partial charges by calling antechamber without
+    blocking the event loop
+
+    Antechamber is run as an asyncio subprocess and the file I/O
+    around it in the default executor of the event loop. At most
+    `ASYNC_CONCURRENCY` runs are in flight at once unless a different
+    semaphore is given. If the task is cancelled, antechamber and its
+    child processes are killed.
+
+    Parameters
+    ----------
+    molecule : parmed.Structure or mbuild.Compound
+        Molecular structure to calculate partial charges for
+    charge_style : str
+        Style of partial charges calculation. Options include
+        'bcc', 'gas', and 'mul'.
+    semaphore : asyncio.Semaphore, optional, default=None
+        Semaphore bounding the number of concurrent antechamber runs.
+        Defaults to a semaphore shared by all calls on the event loop.
+    timeout : float, optional, default=None
+        Maximum time in seconds for the call, excluding time spent
+        waiting for the semaphore. See `ante_atomtyping`.
+    **kwargs
+        Additional keyword arguments (e.g., `net_charge`) are the
+        same as for `ante_charges`.
+
+    Returns
+    -------
+    molecule : parmed.Structure or np.ndarray of float
+        See `ante_charges`
+    """
+    steps = _charges_steps(molecule, charge_style, **kwargs)
+    return await _run_steps_async(steps, semaphore, timeout)
+
+
+def _atomtyping_steps(
+    molecule,
+    atype_style,
+    cache_dir=None,
+    system=False,
+    template=False,
+    input_format="pdb",
+    trust_bond_orders=False,
+    return_structure=True,
+):
+    """Atomtyping pipeline of ante_atomtyping as a generator.
+
+    Yields (command, tmpdir, workdir) for each antechamber run and
+    returns the typed molecule. See `_run_steps`.
+    """
+    _check_antechamber(_antechamber())
 
     # Check valid atomtype name
-    supported_chargetypes = ["bcc", "gas", "mul"]
-    if charge_style not in supported_chargetypes:
-        raise FoyerError(
-            "Unsupported charge style requested. "
-            "Please select from {}".format(supported_chargetypes)
+    _check_atype_style(atype_style)
+    _check_input_format(input_format, trust_bond_orders)
+
+    # Check for parmed.Structure. Convert from mbuild.Compound if possible
+    molecule = _check_structure(molecule, template)
+    if system and template:
+        raise ValueError("system and template cannot be combined")
+    if system:
+        typed_molecule = yield from _atomtyping_system_steps(
+            molecule,
+            atype_style,
+            cache_dir=cache_dir,
+            input_format=input_format,
+            trust_bond_orders=trust_bond_orders,
+            return_structure=return_structure,
         )
+        return typed_molecule
+    # Confirm single connected molecule
+    _check_single_molecule(molecule)
+    if template:
+        typed_molecule = yield from _atomtyping_template_steps(
+            molecule,
+            atype_style,
+            cache_dir=cache_dir,
+            input_format=input_format,
+            trust_bond_orders=trust_bond_orders,
+            return_structure=return_structure,
+        )
+        return typed_molecule
+
+    # Look for an earlier result in the cache
+    cached = None
+    cache_dir = get_cache_dir(cache_dir)
+    if cache_dir is not None:
+        key = cache_key(
+            task="atomtyping",
+            graph=_graph_signature(molecule, trust_bond_orders),
+            atype_style=atype_style,
+            input_format=input_format,
+        )
+        cached = load_cached(cache_dir, key)
+
+    if cached is not None:
+        # The cached types may come from a molecule with the same graph
+        # but other coordinates or names, so only the types are used
+        with timed("read_output"):
+            _, atom_types, _ = read_mol2_atoms(cached)
+    else:
+        # Get current directory to write any error logs
+        workdir = os.getcwd()
+        # Work within a scratch directory
+        # to clean up after antechamber
+        with scratch_directory() as tmpdir:
+            # Save the existing molecule to file
+            input_options = _write_input(
+                molecule, tmpdir, input_format, trust_bond_orders
+            )
+            # Call antechamber
+            command = (
+                [_antechamber()]
+                + input_options
+                + ["-o", "ante_out.mol2", "-fo", "mol2"]
+                + ["-at", atype_style]
+                + ["-s", "2"]
+                + _intermediate_options()
+            )
+            yield command, tmpdir, workdir
+
+            # Now read in the atom types from the mol2 file
+            output = os.path.join(tmpdir, "ante_out.mol2")
+            with timed("read_output"):
+                _, atom_types, _ = read_mol2_atoms(output)
+            if cache_dir is not None:
+                store_cached(cache_dir, key, output)
+
+    if not return_structure:
+        return atom_types
+    # The types are applied to the input molecule, which keeps its
+    # own residues, names, coordinates and bonds
+    return _apply_atom_types(molecule, atom_types)
+
+
+def _charges_steps(
+    molecule,
+    charge_style,
+    net_charge=0.0,
+    multiplicity=1,
+    charge_tol=0.005,
+    cache_dir=None,
+    system=False,
+    template=False,
+    input_format="pdb",
+    trust_bond_orders=False,
+    return_structure=True,
+    coordinates=None,
+    correct_net_charge=True,
+):
+    """Charge pipeline of ante_charges as a generator.
+
+    Yields (command, tmpdir, workdir) for each antechamber run and
+    returns the charged molecule. See `_run_steps`. If given,
+    coordinates replace the positions of the atoms. Without
+    `correct_net_charge`, the charges are returned as antechamber
+    computed them.
+    """
+    _check_antechamber(_antechamber())
+
+    # Check valid charge style
+    _check_charge_style(charge_style)
+    _check_input_format(input_format, trust_bond_orders)
 
     # Check for parmed.Structure. Convert from mbuild.Compound if possible
-    molecule = _check_structure(molecule)
+    molecule = _check_structure(molecule, template)
+    if system and template:
+        raise ValueError("system and template cannot be combined")
+    if system:
+        molecule = yield from _charges_system_steps(
+            molecule,
+            charge_style,
+            net_charge,
+            multiplicity,
+            charge_tol=charge_tol,
+            cache_dir=cache_dir,
+            input_format=input_format,
+            trust_bond_orders=trust_bond_orders,
+            return_structure=return_structure,
+        )
+        return molecule
     # Confirm single connected molecule
     _check_single_molecule(molecule)
+    if template:
+        molecule = yield from _charges_template_steps(
+            molecule,
+            charge_style,
+            net_charge,
+            multiplicity,
+            charge_tol,
+            cache_dir=cache_dir,
+            input_format=input_format,
+            trust_bond_orders=trust_bond_orders,
+            return_structure=return_structure,
+        )
+        return molecule
 
-    # Get current directory to write any error logs
-    workdir = os.getcwd()
-    # Work within a temporary directory
-    # to clean up after antechamber
-    with temporary_directory() as tmpdir:
-        with temporary_cd(tmpdir):
+    # Look for an earlier result in the cache
+    cached = None
+    cache_dir = get_cache_dir(cache_dir)
+    if cache_dir is not None:
+        key = cache_key(
+            task="charges",
+            graph=_graph_signature(molecule, trust_bond_orders),
+            coordinates=_coordinate_signature(molecule, coordinates),
+            input_format=input_format,
+            charge_style=charge_style,
+            net_charge=float(net_charge),
+            multiplicity=int(multiplicity),
+            version=_antechamber_version(cache_dir),
+        )
+        cached = load_cached(cache_dir, key) or load_cached(cache_dir, key, "ac")
+
+    if cached is not None:
+        charges = _read_charges(cached, molecule)
+    elif cache_dir is not None and charge_style in _AM1_CHARGE_STYLES and _am1bcc():
+        charges = yield from _am1_charges_steps(
+            molecule,
+            charge_style,
+            net_charge,
+            multiplicity,
+            cache_dir,
+            key,
+            input_format=input_format,
+            trust_bond_orders=trust_bond_orders,
+            coordinates=coordinates,
+        )
+    else:
+        # Get current directory to write any error logs
+        workdir = os.getcwd()
+        # Work within a scratch directory
+        # to clean up after antechamber
+        with scratch_directory() as tmpdir:
             # Save the existing molecule to file
-            _write_pdb(molecule, "ante_in.pdb")
+            input_options = _write_input(
+                molecule, tmpdir, input_format, trust_bond_orders, coordinates
+            )
             # Call antechamber
             command = (
-                "antechamber -i ante_in.pdb -fi pdb "
-                "-o ante_out.mol2 -fo mol2 "
-                + "-c "
-                + charge_style
-                + " "
-                + "-nc "
-                + str(net_charge)
-                + " "
-                + "-m "
-                + str(multiplicity)
-                + " "
-                + "-s 2"
+                [_antechamber()]
+                + input_options
+                + ["-o", "ante_out.mol2", "-fo", "mol2"]
+                + ["-c", charge_style]
+                + ["-nc", str(net_charge)]
+                + ["-m", str(multiplicity)]
+                + ["-s", "2"]
+                + _intermediate_options()
             )
+            yield command, tmpdir, workdir
+
+            # Now read in the charges from the mol2 file
+            output = os.path.join(tmpdir, "ante_out.mol2")
+            charges = _read_charges(output, molecule)
+            if cache_dir is not None:
+                store_cached(cache_dir, key, output)
+
+    if correct_net_charge:
+        charges = _correct_net_charge(charges, net_charge, charge_tol)
+
+    # Combine charge information with existing molecule structure
+    assert len(molecule.atoms) == len(charges)
+    if not return_structure:
+        return charges
+    for atom, charge in zip(molecule.atoms, charges):
+        atom.charge = float(charge)
+    return molecule
 
-            proc = Popen(
-                command, stdout=PIPE, stderr=PIPE, universal_newlines=True, shell=True
+
+def _am1_charges_steps(
+    molecule,
+    charge_style,
+    net_charge,
+    multiplicity,
+    cache_dir,
+    key,
+    input_format="pdb",
+    trust_bond_orders=False,
+    coordinates=None,
+):
+    """Charge a molecule from a cached AM1 calculation.
+
+    The AM1 Mulliken charges (antechamber -c mul) are cached as an
+    .ac file keyed by the molecule, its geometry, the net charge and
+    multiplicity, but not the charge style. sqm only runs if that
+    file is missing. 'mul' charges are read from it directly and
+    'bcc' charges by applying the bond charge corrections with
+    am1bcc. The result is cached under key.
+    """
+    am1_key = cache_key(
+        task="am1",
+        graph=_graph_signature(molecule, trust_bond_orders),
+        coordinates=_coordinate_signature(molecule, coordinates),
+        input_format=input_format,
+        net_charge=float(net_charge),
+        multiplicity=int(multiplicity),
+        version=_antechamber_version(cache_dir),
+    )
+    am1_output = load_cached(cache_dir, am1_key, "ac")
+
+    workdir = os.getcwd()
+    with scratch_directory() as tmpdir:
+        if am1_output is None:
+            input_options = _write_input(
+                molecule, tmpdir, input_format, trust_bond_orders, coordinates
+            )
+            command = (
+                [_antechamber()]
+                + input_options
+                + ["-o", "am1.ac", "-fo", "ac"]
+                + ["-c", "mul"]
+                + ["-nc", str(net_charge)]
+                + ["-m", str(multiplicity)]
+                + ["-s", "2"]
+                + _intermediate_options()
+            )
+            yield command, tmpdir, workdir
+            am1_output = store_cached(
+                cache_dir, am1_key, os.path.join(tmpdir, "am1.ac"), "ac"
             )
 
-            out, err = proc.communicate()
+        output = am1_output
+        if charge_style == "bcc":
+            am1bcc, bcc_parameters = _am1bcc()
+            command = [am1bcc, "-i", am1_output, "-o", "ante_out.ac", "-f", "ac"]
+            command += ["-p", bcc_parameters, "-j", "1"]
+            yield command, tmpdir, workdir
+            output = os.path.join(tmpdir, "ante_out.ac")
 
-            # Error handling here
-            if "Fatal Error" in err or proc.returncode != 0:
-                _antechamber_error(out, err, workdir)
+        charges = _read_charges(output, molecule)
+        store_cached(cache_dir, key, output, "ac")
+    return charges
 
-            # Now read in the mol2 file with atomtyping
-            charges = pmd.load_file("ante_out.mol2", structure=True)
 
-            charge_list = [atom.charge for atom in charges]
-            if abs(net_charge - sum(charge_list)) > charge_tol:
-                raise ValueError(
-                    "The sum of charges defined by antechamber"
-                    " is {}, which differs from the desired net charge"
-                    " of {} by a value greater than {}".format(
-                        sum(charge_list), net_charge, charge_tol
-                    )
+def _parametrize_steps(
+    molecule,
+    atype_style,
+    charge_style,
+    net_charge=0.0,
+    multiplicity=1,
+    charge_tol=0.005,
+    cache_dir=None,
+    system=False,
+    template=False,
+    input_format="pdb",
+    trust_bond_orders=False,
+    return_structure=True,
+):
+    """Combined pipeline of ante_parametrize as a generator.
+
+    Yields (command, tmpdir, workdir) for each antechamber run and
+    returns the typed and charged molecule. See `_run_steps`.
+    """
+    _check_antechamber(_antechamber())
+
+    # Check valid atomtype name and charge style
+    _check_atype_style(atype_style)
+    _check_charge_style(charge_style)
+    _check_input_format(input_format, trust_bond_orders)
+
+    # Check for parmed.Structure. Convert from mbuild.Compound if possible
+    molecule = _check_structure(molecule, template)
+    if system and template:
+        raise ValueError("system and template cannot be combined")
+    if system:
+        typed_molecule = yield from _parametrize_system_steps(
+            molecule,
+            atype_style,
+            charge_style,
+            net_charge,
+            multiplicity,
+            charge_tol=charge_tol,
+            cache_dir=cache_dir,
+            input_format=input_format,
+            trust_bond_orders=trust_bond_orders,
+            return_structure=return_structure,
+        )
+        return typed_molecule
+    # Confirm single connected molecule
+    _check_single_molecule(molecule)
+    if template:
+        typed_molecule = yield from _parametrize_template_steps(
+            molecule,
+            atype_style,
+            charge_style,
+            net_charge,
+            multiplicity,
+            charge_tol,
+            cache_dir=cache_dir,
+            input_format=input_format,
+            trust_bond_orders=trust_bond_orders,
+            return_structure=return_structure,
+        )
+        return typed_molecule
+
+    # Look for an earlier result in the cache
+    cached = None
+    cache_dir = get_cache_dir(cache_dir)
+    if cache_dir is not None:
+        key = cache_key(
+            task="parametrize",
+            graph=_graph_signature(molecule, trust_bond_orders),
+            coordinates=_coordinate_signature(molecule),
+            input_format=input_format,
+            atype_style=atype_style,
+            charge_style=charge_style,
+            net_charge=float(net_charge),
+            multiplicity=int(multiplicity),
+            version=_antechamber_version(cache_dir),
+        )
+        cached = load_cached(cache_dir, key)
+
+    if cached is not None:
+        with timed("read_output"):
+            names, types, charges = read_mol2_atoms(cached)
+    else:
+        # Get current directory to write any error logs
+        workdir = os.getcwd()
+        # Work within a scratch directory
+        # to clean up after antechamber
+        with scratch_directory() as tmpdir:
+            # Save the existing molecule to file
+            input_options = _write_input(
+                molecule, tmpdir, input_format, trust_bond_orders
+            )
+            # Call antechamber once for both atom types and charges
+            command = (
+                [_antechamber()]
+                + input_options
+                + ["-o", "ante_out.mol2", "-fo", "mol2"]
+                + ["-at", atype_style]
+                + ["-c", charge_style]
+                + ["-nc", str(net_charge)]
+                + ["-m", str(multiplicity)]
+                + ["-s", "2"]
+                + _intermediate_options()
+            )
+            yield command, tmpdir, workdir
+
+            # Now read in the mol2 file with atom types and charges
+            output = os.path.join(tmpdir, "ante_out.mol2")
+            with timed("read_output"):
+                names, types, charges = read_mol2_atoms(output)
+            if cache_dir is not None:
+                store_cached(cache_dir, key, output)
+
+    _check_output_atoms(molecule, names, types)
+    charges = _correct_net_charge(charges, net_charge, charge_tol)
+
+    if not return_structure:
+        return types, charges
+    # The types and charges are applied to the input molecule, which
+    # keeps its own coordinates and names
+    typed_molecule = _apply_atom_types(molecule, types)
+    for atom, charge in zip(typed_molecule.atoms, charges):
+        atom.charge = float(charge)
+    return typed_molecule
+
+
+def _atomtyping_system_steps(molecule, atype_style, return_structure, **kwargs):
+    """Type each unique species of a multi-molecule system once
+    and copy the atom types to every molecule of that species.
+    """
+    atom_types = np.empty(len(molecule.atoms), dtype=object)
+    for representative, copies in _split_species(molecule):
+        species_types = yield from _atomtyping_steps(
+            molecule[representative], atype_style, return_structure=False, **kwargs
+        )
+        for atom_indices in copies:
+            atom_types[atom_indices] = species_types
+    atom_types = atom_types.astype(str)
+
+    if not return_structure:
+        return atom_types
+    return _apply_atom_types(molecule, atom_types)
+
+
+def _charges_system_steps(
+    molecule, charge_style, net_charge, multiplicity, return_structure, **kwargs
+):
+    """Charge each unique species of a multi-molecule system once
+    and copy the charges to every molecule of that species.
+    """
+    charges = np.zeros(len(molecule.atoms))
+    for representative, copies in _split_species(molecule):
+        species = molecule[representative]
+        formula = _formula(species)
+        species_charges = yield from _charges_steps(
+            species,
+            charge_style,
+            net_charge=_per_species(net_charge, formula, 0.0),
+            multiplicity=_per_species(multiplicity, formula, 1),
+            return_structure=False,
+            **kwargs
+        )
+        for atom_indices in copies:
+            charges[atom_indices] = species_charges
+
+    if not return_structure:
+        return charges
+    for atom, charge in zip(molecule.atoms, charges):
+        atom.charge = float(charge)
+    return molecule
+
+
+def _parametrize_system_steps(
+    molecule,
+    atype_style,
+    charge_style,
+    net_charge,
+    multiplicity,
+    return_structure,
+    **kwargs
+):
+    """Type and charge each unique species of a multi-molecule
+    system once and copy the results to every molecule of that
+    species.
+    """
+    atom_types = np.empty(len(molecule.atoms), dtype=object)
+    charges = np.zeros(len(molecule.atoms))
+    for representative, copies in _split_species(molecule):
+        species = molecule[representative]
+        formula = _formula(species)
+        species_types, species_charges = yield from _parametrize_steps(
+            species,
+            atype_style,
+            charge_style,
+            net_charge=_per_species(net_charge, formula, 0.0),
+            multiplicity=_per_species(multiplicity, formula, 1),
+            return_structure=False,
+            **kwargs
+        )
+        for atom_indices in copies:
+            atom_types[atom_indices] = species_types
+            charges[atom_indices] = species_charges
+    atom_types = atom_types.astype(str)
+
+    if not return_structure:
+        return atom_types, charges
+    typed_molecule = molecule.copy(pmd.Structure)
+    for atom, atom_type, charge in zip(typed_molecule.atoms, atom_types, charges):
+        atom.type = atom_type
+        atom.id = atom_type
+        atom.charge = float(charge)
+    return typed_molecule
+
+
+def _fragment_charges(
+    molecule,
+    charge_style,
+    net_charge,
+    multiplicity,
+    charge_tol,
+    fragment_size,
+    return_structure=True,
+    timeout=None,
+    cancel=None,
+    **kwargs
+):
+    """Charge a molecule fragment by fragment. See the `fragment_size`
+    option of `ante_charges`.
+    """
+    _check_antechamber(_antechamber())
+    _check_charge_style(charge_style)
+    molecule = _check_structure(molecule)
+    _check_single_molecule(molecule)
+    formal_charges = _formal_charges(molecule, net_charge, multiplicity, charge_tol)
+
+    labels, cut_bonds = partition(molecule, fragment_size)
+    fragments = component_atoms(labels)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    jobs = []
+    capped = []
+    for atom_indices in fragments:
+        fragment, caps = capped_fragment(molecule, atom_indices, cut_bonds)
+        fragment_charge = float(formal_charges[atom_indices].sum())
+        jobs.append((fragment, charge_style, fragment_charge, deadline, cancel))
+        capped.append(caps)
+
+    function = partial(_charge_fragment, charge_tol=charge_tol, **kwargs)
+    results = _run_batch(function, jobs, n_procs=None, use_threads=True)
+
+    charges = np.zeros(len(molecule.atoms))
+    for atom_indices, caps, fragment_charges in zip(fragments, capped, results):
+        charges[atom_indices] = _fold_cap_charges(fragment_charges, caps)
+    charges = _correct_net_charge(charges, net_charge, charge_tol)
+
+    if not return_structure:
+        return charges
+    for atom, charge in zip(molecule.atoms, charges):
+        atom.charge = float(charge)
+    return molecule
+
+
+def _formal_charges(molecule, net_charge, multiplicity, charge_tol):
+    """Formal charges of the atoms, used to assign a net charge to
+    each fragment or repeat unit of a molecule.
+    """
+    if multiplicity != 1:
+        raise ValueError("Charging by fragments requires multiplicity=1")
+    formal_charges = np.array(
+        [atom.formal_charge or 0 for atom in molecule.atoms], dtype=float
+    )
+    if abs(formal_charges.sum() - net_charge) > charge_tol:
+        raise ValueError(
+            "The formal charges of the atoms sum to {}, which differs "
+            "from the net charge of {}. Charging by fragments needs "
+            "atom.formal_charge to assign a net charge to each "
+            "fragment.".format(formal_charges.sum(), net_charge)
+        )
+    return formal_charges
+
+
+def _fold_cap_charges(charges, capped):
+    """Add the charge of each cap of a fragment to the atom it is
+    bonded to, so that the fragment keeps its net charge. The caps
+    are the last atoms of the fragment.
+    """
+    n_atoms = len(charges) - len(capped)
+    return charges[:n_atoms] + np.bincount(
+        capped, weights=charges[n_atoms:], minlength=n_atoms
+    )
+
+
+def _charge_fragment(fragment, charge_style, net_charge, deadline, cancel, **kwargs):
+    """Charge one capped fragment with the time left until deadline."""
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+    return ante_charges(
+        fragment,
+        charge_style,
+        net_charge=net_charge,
+        return_structure=False,
+        timeout=timeout,
+        cancel=cancel,
+        **kwargs
+    )
+
+
+def _atomtyping_template_steps(molecule, atype_style, return_structure, **kwargs):
+    """Type one capped representative of each repeat unit of a
+    molecule and copy the atom types to every copy of that unit.
+    """
+    units, cut_bonds = repeat_units(molecule)
+    atom_types = np.empty(len(molecule.atoms), dtype=object)
+    for representative, copies in units:
+        fragment, capped = capped_fragment(molecule, representative, cut_bonds)
+        unit_types = yield from _atomtyping_steps(
+            fragment, atype_style, return_structure=False, **kwargs
+        )
+        for atom_indices in copies:
+            atom_types[atom_indices] = unit_types[: len(representative)]
+    atom_types = atom_types.astype(str)
+
+    if not return_structure:
+        return atom_types
+    return _apply_atom_types(molecule, atom_types)
+
+
+def _charges_template_steps(
+    molecule,
+    charge_style,
+    net_charge,
+    multiplicity,
+    charge_tol,
+    return_structure,
+    **kwargs
+):
+    """Charge one capped representative of each repeat unit of a
+    molecule and copy the charges to every copy of that unit.
+    """
+    formal_charges = _formal_charges(molecule, net_charge, multiplicity, charge_tol)
+    units, cut_bonds = repeat_units(molecule)
+    charges = np.zeros(len(molecule.atoms))
+    for representative, copies in units:
+        fragment, capped = capped_fragment(molecule, representative, cut_bonds)
+        unit_charges = yield from _charges_steps(
+            fragment,
+            charge_style,
+            net_charge=float(formal_charges[representative].sum()),
+            charge_tol=charge_tol,
+            return_structure=False,
+            **kwargs
+        )
+        unit_charges = _fold_cap_charges(unit_charges, capped)
+        for atom_indices in copies:
+            charges[atom_indices] = unit_charges
+    charges = _correct_net_charge(charges, net_charge, charge_tol)
+
+    if not return_structure:
+        return charges
+    for atom, charge in zip(molecule.atoms, charges):
+        atom.charge = float(charge)
+    return molecule
+
+
+def _parametrize_template_steps(
+    molecule,
+    atype_style,
+    charge_style,
+    net_charge,
+    multiplicity,
+    charge_tol,
+    return_structure,
+    **kwargs
+):
+    """Type and charge one capped representative of each repeat unit
+    of a molecule and copy the results to every copy of that unit.
+    """
+    formal_charges = _formal_charges(molecule, net_charge, multiplicity, charge_tol)
+    units, cut_bonds = repeat_units(molecule)
+    atom_types = np.empty(len(molecule.atoms), dtype=object)
+    charges = np.zeros(len(molecule.atoms))
+    for representative, copies in units:
+        fragment, capped = capped_fragment(molecule, representative, cut_bonds)
+        unit_types, unit_charges = yield from _parametrize_steps(
+            fragment,
+            atype_style,
+            charge_style,
+            net_charge=float(formal_charges[representative].sum()),
+            charge_tol=charge_tol,
+            return_structure=False,
+            **kwargs
+        )
+        unit_charges = _fold_cap_charges(unit_charges, capped)
+        for atom_indices in copies:
+            atom_types[atom_indices] = unit_types[: len(representative)]
+            charges[atom_indices] = unit_charges
+    atom_types = atom_types.astype(str)
+    charges = _correct_net_charge(charges, net_charge, charge_tol)
+
+    if not return_structure:
+        return atom_types, charges
+    typed_molecule = molecule.copy(pmd.Structure)
+    for atom, atom_type, charge in zip(typed_molecule.atoms, atom_types, charges):
+        atom.type = atom_type
+        atom.id = atom_type
+        atom.charge = float(charge)
+    return typed_molecule
+
+
+def _charge_conformer(
+    molecule,
+    coordinates,
+    charge_style,
+    net_charge,
+    multiplicity,
+    deadline,
+    cancel,
+    **kwargs
+):
+    """Charge one conformer with the time left until deadline. The
+    net charge is not corrected.
+    """
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+    steps = _charges_steps(
+        molecule,
+        charge_style,
+        net_charge=net_charge,
+        multiplicity=multiplicity,
+        return_structure=False,
+        coordinates=coordinates,
+        correct_net_charge=False,
+        **kwargs
+    )
+    return _run_steps(steps, timeout=timeout, cancel=cancel)
+
+
+def _split_species(molecule):
+    """Split a structure into molecules and group identical species.
+
+    Molecules are the connected components of the bond graph. Two
+    molecules belong to the same species if their elements and bonds
+    are identical, with atoms compared in the order they appear in
+    the structure.
+
+    Returns
+    -------
+    species : list of (list of int, list of list of int)
+        For each species in order of first appearance, the atom
+        indices of the first molecule and the atom indices of every
+        molecule of that species (including the first)
+    """
+    bonds = bond_array(molecule)
+    _, labels = connected_components(len(molecule.atoms), bonds)
+    _, local_bonds = component_bonds(labels, bonds)
+
+    species = OrderedDict()
+    for atom_indices, bonds in zip(component_atoms(labels), local_bonds):
+        atom_indices = atom_indices.tolist()
+        signature = (
+            tuple(molecule.atoms[atom_idx].element for atom_idx in atom_indices),
+            tuple(map(tuple, bonds.tolist())),
+        )
+        species.setdefault(signature, []).append(atom_indices)
+
+    return [(copies[0], copies) for copies in species.values()]
+
+
+def _formula(molecule):
+    """Chemical formula of the structure in Hill order."""
+    counts = {}
+    for atom in molecule.atoms:
+        counts[atom.element_name] = counts.get(atom.element_name, 0) + 1
+    if "C" in counts:
+        order = ["C", "H"] + sorted(el for el in counts if el not in ("C", "H"))
+    else:
+        order = sorted(counts)
+    return "".join(
+        el + (str(counts[el]) if counts[el] > 1 else "") for el in order if el in counts
+    )
+
+
+def _per_species(value, formula, default):
+    """Look up a per-species setting given as a scalar or as
+    a dict keyed by chemical formula.
+    """
+    if isinstance(value, dict):
+        return value.get(formula, default)
+    return value
+
+
+@timed("read_output")
+def _read_charges(filename, molecule):
+    """Read the charges from a mol2 or .ac file and check that its
+    atoms match those of the molecule.
+    """
+    if filename.endswith(".ac"):
+        names, types, charges = read_ac_atoms(filename)
+    else:
+        names, types, charges = read_mol2_atoms(filename)
+    _check_output_atoms(molecule, names, types)
+    return charges
+
+
+def _check_output_atoms(molecule, names, types):
+    """Check that the atoms antechamber wrote, given by their names
+    and types, match the atoms of the molecule.
+    """
+    if len(molecule.atoms) != len(names):
+        raise RuntimeError(
+            "Antechamber wrote {} atoms for a molecule with {} "
+            "atoms".format(len(names), len(molecule.atoms))
+        )
+    for atom, name, atom_type in zip(molecule.atoms, names, types):
+        elements = _guess_elements(name) | _guess_elements(atom_type)
+        # Atoms whose element is unknown on either side are not checked
+        if not atom.atomic_number or not elements:
+            continue
+        if atom.element_name not in elements:
+            raise RuntimeError(
+                "Antechamber output does not match the molecule: atom {} "
+                "({}) is {}, but antechamber wrote {} of type {}".format(
+                    atom.idx, atom.name, atom.element_name, name, atom_type
                 )
-            elif abs(net_charge - sum(charge_list)) < charge_tol:
-                charge_delta = (net_charge - sum(charge_list)) / len(charge_list)
-                for atom in charges:
-                    atom.charge += charge_delta
+            )
 
-    # Combine charge information with existing molecule structure
-    assert len(molecule.atoms) == len(charges.atoms)
-    for atom_idx in range(len(molecule.atoms)):
-        assert molecule.atoms[atom_idx].element == charges.atoms[atom_idx].element
-        molecule.atoms[atom_idx].charge = charges.atoms[atom_idx].charge
+
+def _guess_elements(name):
+    """Elements an atom name or type may stand for, such as C and Cl
+    for 'CL1'. Empty if it stands for no element, as '1X' does.
+    """
+    letters = "".join(c for c in name if c.isalpha())
+    elements = {element_by_name(letters)} if letters else set()
+    if letters[:2].capitalize() in AtomicNum:
+        elements.add(letters[:2].capitalize())
+    # parmed guesses 'EP' (extra point) for names it cannot resolve
+    elements.discard("EP")
+    return elements
+
+
+def _apply_atom_types(molecule, atom_types):
+    """Copy of the molecule with the given atom types."""
+    typed_molecule = molecule.copy(pmd.Structure)
+    for atom, atom_type in zip(typed_molecule.atoms, atom_types):
+        atom.type = atom_type
+        # Foyer requires that the atom type info is stored under atom.id
+        atom.id = atom_type
+    return typed_molecule
+
+
+def _correct_net_charge(charges, net_charge, charge_tol):
+    """Check the sum of the charges against the net charge and
+    spread any small difference evenly over the atoms.
+    """
+    charges = np.asarray(charges, dtype=float)
+    total_charge = charges.sum()
+    if abs(net_charge - total_charge) > charge_tol:
+        raise ValueError(
+            "The sum of charges defined by antechamber"
+            " is {}, which differs from the desired net charge"
+            " of {} by a value greater than {}".format(
+                total_charge, net_charge, charge_tol
+            )
+        )
+    elif abs(net_charge - total_charge) < charge_tol:
+        charge_delta = (net_charge - total_charge) / len(charges)
+        charges = charges + charge_delta
+    return charges
+
+
+def _run_batch(
+    function,
+    jobs,
+    n_procs,
+    use_threads=False,
+    return_exceptions=False,
+    costs=None,
+    on_result=None,
+    mp_context=None,
+):
+    """Call function on each set of arguments in jobs, using a
+    process (or thread) pool when more than one worker is requested.
+    Results are returned in the order of jobs. If the estimated cost
+    of each job is given, jobs are submitted as scheduled by
+    `lpt_chunks`. If given, on_result is called in the calling thread
+    with the index and result of each job as soon as it is done.
+    mp_context is the multiprocessing context of the process pool.
+    """
+    if return_exceptions:
+        function = partial(_return_exceptions, function)
+
+    if n_procs is None:
+        n_procs = os.cpu_count() or 1
+    if n_procs < 1:
+        raise ValueError("n_procs must be a positive integer")
+
+    n_procs = min(n_procs, len(jobs))
+    if n_procs <= 1:
+        results = []
+        for idx, args in enumerate(jobs):
+            results.append(function(*args))
+            if on_result is not None:
+                on_result(idx, results[-1])
+        return results
+
+    if use_threads:
+        pool = ThreadPoolExecutor
+    else:
+        pool = partial(_process_pool, mp_context=mp_context)
+    if costs is None and on_result is None:
+        with pool(max_workers=n_procs) as executor:
+            return list(executor.map(function, *zip(*jobs)))
+
+    if costs is None:
+        chunks = [[idx] for idx in range(len(jobs))]
+    else:
+        chunks = lpt_chunks(costs, n_procs)
+    results = [None] * len(jobs)
+    error = None
+    with pool(max_workers=n_procs) as executor:
+        futures = {
+            executor.submit(_run_chunk, function, [jobs[idx] for idx in chunk]): chunk
+            for chunk in chunks
+        }
+        # Finished jobs are handled even after another one failed
+        for future in as_completed(futures):
+            try:
+                chunk_results = future.result()
+            except Exception as chunk_error:
+                error = error or chunk_error
+                continue
+            for idx, (result, job_error) in zip(futures[future], chunk_results):
+                if job_error is not None:
+                    error = error or job_error
+                    continue
+                results[idx] = result
+                if on_result is not None:
+                    on_result(idx, result)
+    if error is not None:
+        raise error
+    return results
+
+
+def _process_pool(max_workers, mp_context=None):
+    """Process pool whose workers run the antechamber executable with
+    the scratch configuration of this process. Workers started with
+    the spawn or forkserver methods do not inherit module state.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=(_antechamber(), get_scratch_config()),
+    )
+
+
+def _init_worker(antechamber, scratch_config):
+    global ANTECHAMBER
+    ANTECHAMBER = antechamber
+    set_scratch_config(scratch_config)
+
+
+def _manifest_key(
+    molecule, charge_style, net_charge, multiplicity, charge_tol, version, options
+):
+    """Key of a batch job in a manifest, see `ante_charges_batch`."""
+    return cache_key(
+        task="charges",
+        graph=_graph_signature(molecule, options.get("trust_bond_orders", False)),
+        coordinates=_coordinate_signature(molecule),
+        charge_style=charge_style,
+        net_charge=float(net_charge),
+        multiplicity=int(multiplicity),
+        charge_tol=float(charge_tol),
+        version=version,
+        options={
+            name: options[name]
+            for name in (
+                "system",
+                "template",
+                "fragment_size",
+                "input_format",
+                "trust_bond_orders",
+            )
+            if name in options
+        },
+    )
+
+
+def _result_charges(result):
+    """Charges of a result of `ante_charges` as a list."""
+    if isinstance(result, pmd.Structure):
+        return [atom.charge for atom in result.atoms]
+    return np.asarray(result, dtype=float).tolist()
+
+
+def _restore_charges(molecule, charges, return_structure=True):
+    """Result of `ante_charges` from charges read from a manifest."""
+    if not return_structure:
+        return np.array(charges, dtype=float)
+    for atom, charge in zip(molecule.atoms, charges):
+        atom.charge = charge
     return molecule
 
 
-def _write_pdb(molecule, filename):
+def _run_stream(
+    function, jobs, n_procs, use_threads, window, ordered, return_exceptions
+):
+    """Call function on each set of arguments from the iterable jobs
+    in a process (or thread) pool, yielding (index, result) pairs.
+
+    Jobs are taken from the iterable only while fewer than window of
+    them are running or waiting to be yielded.
+    """
+    if return_exceptions:
+        function = partial(_return_exceptions, function)
+    if n_procs is None:
+        n_procs = os.cpu_count() or 1
+    if n_procs < 1:
+        raise ValueError("n_procs must be a positive integer")
+    if window is None:
+        window = 2 * n_procs
+    if window < 1:
+        raise ValueError("window must be a positive integer")
+
+    jobs = enumerate(jobs)
+    pool = ThreadPoolExecutor if use_threads else _process_pool
+    running = {}
+    waiting = {}
+    next_idx = 0
+    with pool(max_workers=n_procs) as executor:
+        try:
+            while True:
+                while len(running) + len(waiting) < window:
+                    try:
+                        idx, args = next(jobs)
+                    except StopIteration:
+                        break
+                    running[executor.submit(function, *args)] = idx
+                if not running:
+                    return
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx = running.pop(future)
+                    if ordered:
+                        waiting[idx] = future.result()
+                    else:
+                        yield idx, future.result()
+                while next_idx in waiting:
+                    yield next_idx, waiting.pop(next_idx)
+                    next_idx += 1
+        finally:
+            # Jobs not started yet are dropped if the caller stops early
+            for future in running:
+                future.cancel()
+
+
+def _keep_title(function, molecule, *args):
+    """Call function, giving a returned structure the title of
+    the molecule it was made from.
+    """
+    result = function(molecule, *args)
+    if isinstance(result, pmd.Structure):
+        result.title = molecule.title
+    return result
+
+
+def _write_stream(results, output):
+    """Write the molecules from (index, result) pairs to a mol2 file
+    as they come. Returns the number of molecules written.
+    """
+    n_written = 0
+    with open(output, "w") as mol2:
+        for idx, result in results:
+            if isinstance(result, Exception):
+                warnings.warn("Skipping molecule {}: {}".format(idx, result))
+                continue
+            write_mol2_record(result, mol2)
+            mol2.flush()
+            n_written += 1
+    return n_written
+
+
+def _check_stream_output(output, kwargs):
+    if output is not None and not kwargs.get("return_structure", True):
+        raise ValueError("output cannot be combined with return_structure=False")
+
+
+def _formal_net_charge(molecule):
+    """Sum of the formal charges of the atoms of a molecule."""
+    return float(sum(atom.formal_charge or 0 for atom in molecule.atoms))
+
+
+def _run_chunk(function, jobs):
+    """Call function on each set of arguments in jobs, in turn.
+
+    Returns (result, error) for each job. A failing job does not
+    stop the others, so their results are not lost with it.
+    """
+    outcomes = []
+    for args in jobs:
+        try:
+            outcomes.append((function(*args), None))
+        except Exception as error:
+            outcomes.append((None, error))
+    return outcomes
+
+
+def _return_exceptions(function, *args):
+    """Call function, returning any exception instead of raising it."""
+    try:
+        return function(*args)
+    except Exception as error:
+        return error
+
+
+def _call_timed(function, *args):
+    """Call function and measure the time it spends in antechamber.
+
+    Returns the result and the seconds spent in the runs made by
+    this thread, or None for the seconds if antechamber itself did
+    not run (e.g., the result was cached).
+    """
+    thread = threading.get_ident()
+    runs = []
+
+    def callback(record):
+        if record["stage"] == "antechamber" and threading.get_ident() == thread:
+            runs.append(record)
+
+    add_timing_callback(callback)
+    try:
+        result = function(*args)
+    finally:
+        remove_timing_callback(callback)
+
+    antechamber = os.path.basename(_antechamber())
+    if not any(run["program"] == antechamber for run in runs):
+        return result, None
+    return result, sum(run["seconds"] for run in runs)
+
+
+def _per_molecule(value, n_molecules, name):
+    """Expand a scalar argument to one value per molecule."""
+    if isinstance(value, (str, bytes)) or not hasattr(value, "__len__"):
+        return [value] * n_molecules
+    if len(value) != n_molecules:
+        raise ValueError(
+            "Length of {} ({}) does not match the number "
+            "of molecules ({})".format(name, len(value), n_molecules)
+        )
+    return list(value)
+
+
+@timed("write_input")
+def _write_input(
+    molecule, directory, input_format, trust_bond_orders, coordinates=None
+):
+    """Write the antechamber input file to directory. Returns the
+    antechamber options that read it when run from directory.
+    If given, coordinates replace the positions of the atoms.
+    """
+    filename = "ante_in." + input_format
+    path = os.path.join(directory, filename)
+    if input_format == "mol2":
+        _write_mol2(molecule, path, coordinates)
+    else:
+        _write_pdb(molecule, path, coordinates)
+
+    options = ["-i", filename, "-fi", input_format]
+    if trust_bond_orders:
+        # Assign atom types only; keep the bond types from the file
+        options += ["-j", "1"]
+    return options
+
+
+def _intermediate_options():
+    """Antechamber options to remove its intermediate files,
+    if requested in the scratch configuration.
+    """
+    if get_scratch_config()["remove_intermediates"]:
+        return ["-pf", "y"]
+    return []
+
+
+_MOL2_BOND_TYPES = {1.0: "1", 2.0: "2", 3.0: "3", 1.5: "ar"}
+
+
+def _write_mol2(molecule, filename, coordinates=None):
+    """Write a mol2 file with the bond orders of the structure."""
+
+    atom_lines = [
+        "{:7d} {:<8s}{:12.4f}{:12.4f}{:12.4f} {:<8s}{:5d} {:<8s}{:10.6f}\n".format(
+            atom.idx + 1,
+            atom.name,
+            xyz[0],
+            xyz[1],
+            xyz[2],
+            atom.element_name,
+            1,
+            "RES",
+            0.0,
+        )
+        for atom, xyz in zip(molecule.atoms, _atom_coordinates(molecule, coordinates))
+    ]
+    bond_lines = [
+        "{:6d}{:7d}{:7d} {}\n".format(
+            bond_idx + 1,
+            bond.atom1.idx + 1,
+            bond.atom2.idx + 1,
+            _MOL2_BOND_TYPES.get(bond.order, "1"),
+        )
+        for bond_idx, bond in enumerate(molecule.bonds)
+    ]
+
+    with open(filename, "w") as mol2:
+        mol2.write("@<TRIPOS>MOLECULE\n")
+        mol2.write("RES\n")
+        mol2.write(
+            "{:5d} {:5d} {:5d} {:5d} {:5d}\n".format(
+                len(molecule.atoms), len(molecule.bonds), 1, 0, 0
+            )
+        )
+        mol2.write("SMALL\nNO_CHARGES\n\n\n")
+        mol2.write("@<TRIPOS>ATOM\n")
+        mol2.write("".join(atom_lines))
+        mol2.write("@<TRIPOS>BOND\n")
+        mol2.write("".join(bond_lines))
+        mol2.write("@<TRIPOS>SUBSTRUCTURE\n")
+        mol2.write("     1 RES         1 TEMP        0 ****  ****    0 ROOT\n")
+
+
+def _write_pdb(molecule, filename, coordinates=None):
     """Write a pdb file with CONECT records."""
 
-    # Check that we have a box. If not, define one.
-    if molecule.box is None:
-        molecule.box = [10.0, 10.0, 10.0, 90.0, 90.0, 90.0]
+    # Check that we have a box. If not, define one. The molecule
+    # itself is left untouched, since it may be shared between threads.
+    box = molecule.box
+    if box is None:
+        box = [10.0, 10.0, 10.0, 90.0, 90.0, 90.0]
 
-    assert len(molecule.box) == 6, "Invalid box object."
+    assert len(box) == 6, "Invalid box object."
 
-    # Generate CONECT records
-    conect = {atom.idx: [] for atom in molecule.atoms}
-    for atom in molecule.atoms:
-        atidx = atom.idx
-        for bond in molecule.bonds:
-            if bond.atom1.idx == atidx:
-                conect[atidx].append(bond.atom2.idx)
-            elif bond.atom2.idx == atidx:
-                conect[atidx].append(bond.atom1.idx)
+    # Generate CONECT records from a single pass over the bonds
+    conect = [[] for atom in molecule.atoms]
+    for bond in molecule.bonds:
+        conect[bond.atom1.idx].append(bond.atom2.idx)
+        conect[bond.atom2.idx].append(bond.atom1.idx)
+
+    atom_lines = [
+        "ATOM  {:5d} {:4s} RES A{:4d}    "
+        "{:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}"
+        "          {:>2s}  \n".format(
+            atom.idx + 1,
+            atom.name,
+            0,
+            xyz[0],
+            xyz[1],
+            xyz[2],
+            1.0,
+            0.0,
+            atom.element_name,
+        )
+        for atom, xyz in zip(molecule.atoms, _atom_coordinates(molecule, coordinates))
+    ]
+    conect_lines = [
+        "CONECT{:5d}".format(atidx + 1)
+        + "".join("{:5d}".format(at2idx + 1) for at2idx in atomlist)
+        + "\n"
+        for atidx, atomlist in enumerate(conect)
+    ]
 
     with open(filename, "w") as pdb:
         pdb.write("REMARK 1   Created by antefoyer\n")
         pdb.write(
             "CRYST1{:9.3f}{:9.3f}{:9.3f}{:7.2f}{:7.2f}{:7.2f}"
             " {:9s}{:3d}\n".format(
-                molecule.box[0],
-                molecule.box[1],
-                molecule.box[2],
-                molecule.box[3],
-                molecule.box[4],
-                molecule.box[5],
+                box[0],
+                box[1],
+                box[2],
+                box[3],
+                box[4],
+                box[5],
                 molecule.space_group,
                 1,
             )
         )
-        for atom in molecule.atoms:
-            pdb.write(
-                "ATOM  {:5d} {:4s} RES A{:4d}    "
-                "{:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}"
-                "          {:>2s}  \n".format(
-                    atom.idx + 1,
-                    atom.name,
-                    0,
-                    atom.xx,
-                    atom.xy,
-                    atom.xz,
-                    1.0,
-                    0.0,
-                    atom.element_name,
-                )
-            )
-        for atidx, atomlist in conect.items():
-            pdb.write("CONECT{:5d}".format(atidx + 1))
-            for at2idx in atomlist:
-                pdb.write("{:5d}".format(at2idx + 1))
-            pdb.write("\n")
+        pdb.write("".join(atom_lines))
+        pdb.write("".join(conect_lines))
 
 
-def _check_structure(molecule):
+def _atom_coordinates(molecule, coordinates=None):
+    """Positions of the atoms, unless overridden by coordinates."""
+    if coordinates is not None:
+        return np.asarray(coordinates, dtype=float).tolist()
+    return [(atom.xx, atom.xy, atom.xz) for atom in molecule.atoms]
+
+
+def _foyer_error(message):
+    """Create a FoyerError. foyer is slow to import, so it is only
+    imported once there is an error to report.
+    """
+    from foyer.exceptions import FoyerError
+
+    return FoyerError(message)
+
+
+@timed("check_structure")
+def _check_structure(molecule, template=False):
     """ Confirm that input is parmed.Structure. Convert
     from mbuild.Compound to parmed.Structure if possible.
+    With `template`, the children of the compound become
+    the residues of the structure.
     """
-    if not isinstance(molecule, pmd.Structure) and has_mbuild:
-        mb = import_("mbuild")
+    # An mbuild.Compound can only exist if mbuild was imported
+    mb = sys.modules.get("mbuild")
+    if not isinstance(molecule, pmd.Structure) and mb is not None:
         if isinstance(molecule, mb.Compound):
-            molecule = molecule.to_parmed()
+            residues = None
+            if template and molecule.children:
+                residues = sorted({child.name for child in molecule.children})
+            molecule = molecule.to_parmed(residues=residues)
 
     if not isinstance(molecule, pmd.Structure):
-        raise FoyerError(
+        raise _foyer_error(
             "Unknown molecule format: {}\n"
             "Supported formats are: "
             '"parmed.Structure" and '
@@ -258,35 +2235,356 @@ def _check_structure(molecule):
     return molecule
 
 
+@timed("check_single_molecule")
 def _check_single_molecule(molecule):
     """ Confirms that the parmed structure represents a single
     connect molecule with connectivity info present.
     """
-    graph_nodes = []
-    graph_edges = []
-    for atom in molecule.atoms:
-        graph_nodes.append(atom.idx)
-    for bond in molecule.bonds:
-        graph_edges.append([bond.atom1.idx, bond.atom2.idx])
-    bond_graph = nx.Graph()
-    bond_graph.add_edges_from(graph_edges)
-    bond_graph.add_nodes_from(graph_nodes)
-    if not nx.is_connected(bond_graph):
-        raise FoyerError(
+    n_components, _ = connected_components(
+        len(molecule.atoms), bond_array(molecule)
+    )
+    if n_components != 1:
+        raise _foyer_error(
             "Antechamber requires connectivity information and "
             "only supports single molecules (i.e., all atoms "
             "in the molecule are connected by bonds."
         )
 
 
+def _check_atype_style(atype_style):
+    """Confirm that antechamber supports the atomtyping style."""
+    supported_atomtypes = ["gaff", "gaff2", "amber", "bcc", "sybyl"]
+    if atype_style not in supported_atomtypes:
+        raise _foyer_error(
+            "Unsupported atomtyping style requested. "
+            "Please select from {}".format(supported_atomtypes)
+        )
+
+
+def _check_input_format(input_format, trust_bond_orders):
+    """Confirm that the antechamber input format is supported."""
+    supported_formats = ["pdb", "mol2"]
+    if input_format not in supported_formats:
+        raise _foyer_error(
+            "Unsupported input format requested. "
+            "Please select from {}".format(supported_formats)
+        )
+    if trust_bond_orders and input_format != "mol2":
+        raise _foyer_error(
+            "Bond orders can only be passed to antechamber "
+            "with input_format='mol2'"
+        )
+
+
+def _check_charge_style(charge_style):
+    """Confirm that antechamber supports the charge style."""
+    supported_chargetypes = ["bcc", "gas", "mul"]
+    if charge_style not in supported_chargetypes:
+        raise _foyer_error(
+            "Unsupported charge style requested. "
+            "Please select from {}".format(supported_chargetypes)
+        )
+
+
+def _graph_signature(molecule, bond_orders=False):
+    """Elements and bonds of the molecule in a canonical,
+    JSON serializable form. Atom order is preserved since the
+    results are mapped back onto the atoms by index. Bond orders
+    are included if requested.
+    """
+    elements = [atom.element for atom in molecule.atoms]
+    if bond_orders:
+        bonds = sorted(
+            sorted((bond.atom1.idx, bond.atom2.idx)) + [bond.order]
+            for bond in molecule.bonds
+        )
+    else:
+        bonds = sorted(
+            sorted((bond.atom1.idx, bond.atom2.idx)) for bond in molecule.bonds
+        )
+    return [elements, bonds]
+
+
+def _coordinate_signature(molecule, coordinates=None):
+    """Coordinates of the molecule at the precision written
+    to the antechamber input file.
+    """
+    return [
+        "{:.3f} {:.3f} {:.3f}".format(*xyz)
+        for xyz in _atom_coordinates(molecule, coordinates)
+    ]
+
+
+_ANTECHAMBER_VERSIONS = {}
+
+
+def _antechamber_version(cache_dir=None):
+    """Detect the version of the antechamber executable.
+
+    The version is remembered per executable (path, size and
+    modification time) for the lifetime of the process and, if a
+    cache directory is given, across processes.
+    """
+    antechamber = _antechamber()
+    stat = os.stat(antechamber)
+    fingerprint = "{}:{}:{}".format(
+        os.path.realpath(antechamber), stat.st_size, stat.st_mtime_ns
+    )
+    if fingerprint in _ANTECHAMBER_VERSIONS:
+        return _ANTECHAMBER_VERSIONS[fingerprint]
+
+    versions = {}
+    if cache_dir is not None:
+        versions = load_metadata(cache_dir, "versions")
+    version = versions.get(fingerprint)
+
+    if version is None:
+        proc = Popen(
+            [antechamber, "-L"], stdout=PIPE, stderr=PIPE, universal_newlines=True
+        )
+        out, err = proc.communicate()
+        match = re.search(r"antechamber\s+([0-9][\w.]*)", out + err)
+        version = match.group(1) if match else "unknown"
+        if cache_dir is not None:
+            versions[fingerprint] = version
+            store_metadata(cache_dir, "versions", versions)
+
+    _ANTECHAMBER_VERSIONS[fingerprint] = version
+    return version
+
+
+def _run_steps(steps, timeout=None, cancel=None):
+    """Drive a pipeline generator such as `_atomtyping_steps`.
+
+    Each (command, tmpdir, workdir) yielded by the generator is run
+    with `_run_antechamber`. Errors are raised inside the generator so
+    that it can clean up. Returns the value returned by the generator.
+    The timeout applies to all runs together.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    send, value = steps.send, None
+    while True:
+        try:
+            command = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            with timed("antechamber", program=os.path.basename(command[0][0])):
+                value = _run_antechamber(*command, deadline=deadline, cancel=cancel)
+            send = steps.send
+        except Exception as error:
+            send, value = steps.throw, error
+
+
+async def _run_steps_async(steps, semaphore=None, timeout=None):
+    """Asynchronous counterpart of `_run_steps`. Time spent waiting
+    for the semaphore does not count towards the timeout.
+
+    The work of the generator between antechamber runs (writing the
+    input, reading the output, the cache and the version probe) blocks,
+    so it is run in the default executor of the event loop.
+    """
+    if semaphore is None:
+        semaphore = _async_semaphore()
+    loop = asyncio.get_running_loop()
+    spent = 0.0
+    send, value = steps.send, None
+    while True:
+        done, command = await loop.run_in_executor(None, _advance_steps, send, value)
+        if done:
+            return command
+        try:
+            async with semaphore:
+                start = time.monotonic()
+                try:
+                    remaining = None if timeout is None else timeout - spent
+                    with timed("antechamber", program=os.path.basename(command[0][0])):
+                        value = await _run_antechamber_async(*command, timeout=remaining)
+                finally:
+                    spent += time.monotonic() - start
+            send = steps.send
+        except Exception as error:
+            send, value = steps.throw, error
+
+
+def _advance_steps(send, value):
+    """Advance a pipeline generator to its next command. Returns
+    (True, result) once the generator is finished, since StopIteration
+    cannot be passed through a future.
+    """
+    try:
+        return False, send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def _async_semaphore():
+    """Semaphore shared by all asynchronous antechamber runs on
+    the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _ASYNC_SEMAPHORES.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY or os.cpu_count() or 1)
+        _ASYNC_SEMAPHORES[loop] = semaphore
+    return semaphore
+
+
+def _run_antechamber(command, tmpdir, workdir, deadline=None, cancel=None):
+    """Run an antechamber command with tmpdir as its working
+    directory. The working directory of the Python process is not
+    changed, so several commands can run from different threads.
+
+    Antechamber is started in a new process group. If the deadline
+    (in time.monotonic() seconds) passes, the cancel event is set or
+    the caller is interrupted, the whole group is killed.
+    """
+    proc = Popen(
+        command,
+        stdout=PIPE,
+        stderr=PIPE,
+        universal_newlines=True,
+        cwd=tmpdir,
+        start_new_session=True,
+    )
+
+    try:
+        while True:
+            wait = None if cancel is None else _POLL_INTERVAL
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0.0)
+                wait = remaining if wait is None else min(wait, remaining)
+            try:
+                out, err = proc.communicate(timeout=wait)
+                break
+            except TimeoutExpired:
+                if cancel is not None and cancel.is_set():
+                    raise AntechamberCancelledError("Antechamber run was cancelled")
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise AntechamberTimeoutError(
+                        "Antechamber did not finish in time and was killed"
+                    )
+    except BaseException:
+        _kill_process_group(proc)
+        proc.communicate()
+        raise
+
+    # Error handling here
+    if "Fatal Error" in err or proc.returncode != 0:
+        _antechamber_error(out, err, workdir)
+
+
+async def _run_antechamber_async(command, tmpdir, workdir, timeout=None):
+    """Run an antechamber command as an asyncio subprocess. The
+    process group is killed on timeout or when the task is cancelled.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=tmpdir,
+        start_new_session=True
+    )
+
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        _kill_process_group(proc)
+        await _reap_process(proc)
+        raise AntechamberTimeoutError(
+            "Antechamber did not finish in time and was killed"
+        )
+    except BaseException:
+        _kill_process_group(proc)
+        await _reap_process(proc)
+        raise
+    out = out.decode(errors="replace")
+    err = err.decode(errors="replace")
+
+    # Error handling here
+    if "Fatal Error" in err or proc.returncode != 0:
+        _antechamber_error(out, err, workdir)
+
+
+async def _reap_process(proc):
+    """Wait for a killed asyncio subprocess so that it does not linger
+    as a zombie. The wait is shielded from the cancellation of the
+    task that is being cleaned up and gives up after _REAP_TIMEOUT.
+    """
+    try:
+        await asyncio.wait_for(asyncio.shield(proc.wait()), _REAP_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+
+
+def _kill_process_group(proc):
+    """Kill a process started with start_new_session=True together
+    with any children it spawned.
+    """
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (OSError, ProcessLookupError):
+        pass
+
+
 def _antechamber_error(out, err, workdir):
-    """Log antechamber output to file. """
-    with open(workdir + "/ante_errorlog.txt", "w") as log_file:
+    """Log antechamber output to file. Each failed run gets a log file
+    of its own, so that concurrent failures do not overwrite each other.
+    """
+    fd, log_path = tempfile.mkstemp(
+        prefix="ante_errorlog_", suffix=".txt", dir=workdir, text=True
+    )
+    with os.fdopen(fd, "w") as log_file:
         log_file.write("STDOUT:\n\n")
         log_file.write(out)
         log_file.write("STDERR:\n\n")
         log_file.write(err)
-    raise RuntimeError("Antechamber failed. See 'ante_errorlog.txt'")
+    raise RuntimeError("Antechamber failed. See '{}'".format(log_path))
+
+
+def _antechamber():
+    """Path to the antechamber executable, or None if it is not
+    installed. It is looked up on first use: the ANTEFOYER_ANTECHAMBER
+    environment variable takes precedence over the PATH (see
+    antefoyer.testing for a stand-in). Set `ANTECHAMBER` to use a
+    different executable later on.
+    """
+    global ANTECHAMBER
+    try:
+        return ANTECHAMBER
+    except NameError:
+        ANTECHAMBER = os.environ.get(ANTECHAMBER_ENV) or shutil.which("antechamber")
+        return ANTECHAMBER
+
+
+def __getattr__(name):
+    if name == "ANTECHAMBER":
+        return _antechamber()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def _am1bcc():
+    """Paths to the am1bcc executable and its bond charge correction
+    parameters, or None if either is not found. They are looked for
+    in AMBERHOME and in the installation antechamber belongs to.
+    """
+    antechamber = _antechamber()
+    if not antechamber:
+        return None
+    bin_dir = os.path.dirname(antechamber)
+    installs = [(bin_dir, os.path.dirname(bin_dir))]
+    if os.environ.get("AMBERHOME"):
+        amberhome = os.environ["AMBERHOME"]
+        installs.insert(0, (os.path.join(amberhome, "bin"), amberhome))
+    for bin_dir, prefix in installs:
+        am1bcc = os.path.join(bin_dir, "am1bcc")
+        bcc_parameters = os.path.join(prefix, "dat", "antechamber", "BCCPARM.DAT")
+        if os.path.isfile(am1bcc) and os.path.isfile(bcc_parameters):
+            return am1bcc, bcc_parameters
+    return None
 
 
 def _check_antechamber(ANTECHAMBER):
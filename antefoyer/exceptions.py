@@ -0,0 +1,6 @@
+class AntechamberTimeoutError(RuntimeError):
+    """Raised when an antechamber run does not finish in time """
+
+
+class AntechamberCancelledError(RuntimeError):
+    """Raised when an antechamber run is cancelled by the caller """
@@ -1,28 +1,196 @@
 import os
+import sys
 import glob
-from pkg_resources import resource_filename
+import hashlib
+import pickle
+import tempfile
+import threading
+import warnings
+
+# Force fields are parsed once per name and shared between callers
+_FORCEFIELDS = {}
+_FORCEFIELD_INDEX = {}
+_FORCEFIELD_LOCK = threading.RLock()
+
+# Compiled (pickled) force fields are stored here
+FF_CACHE_DIR_ENV = 'ANTEFOYER_FF_CACHE_DIR'
+_COMPILED_FORMAT = 1
 
 def get_ff_path():
-    return [resource_filename('antefoyer', 'xml')]
+    return [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xml')]
 
 def get_forcefield_paths():
+    file_paths = []
     for dir_path in get_ff_path():
         file_pattern = os.path.join(dir_path, '*.xml')
-        file_paths = [file_path for file_path in glob.glob(file_pattern)]
+        file_paths.extend(glob.glob(file_pattern))
     return file_paths
 
-def get_forcefield(name=None):
-    from foyer import Forcefield
+def get_forcefield_index():
+    """Map force field names to the bundled XML files.
+
+    The name of a force field is its file name without the .xml
+    extension. The index is built on first use.
+    """
+    with _FORCEFIELD_LOCK:
+        if not _FORCEFIELD_INDEX:
+            for ff_path in get_forcefield_paths():
+                name = os.path.splitext(os.path.basename(ff_path))[0]
+                _FORCEFIELD_INDEX.setdefault(name, ff_path)
+        return dict(_FORCEFIELD_INDEX)
+
+def get_forcefield(name=None, compiled=True):
+    """Return the bundled force field with the given name.
+
+    The XML file is parsed on the first request only. Later requests
+    return the same foyer.Forcefield object, which should therefore
+    not be modified. See `clear_forcefield_cache`.
+
+    If `compiled` is True and a compiled form of the force field has
+    been created with `compile_forcefield`, a fresh process loads the
+    force field from it instead of parsing the XML file. Loading
+    never creates the compiled form.
+    """
     if name is None:
         raise ValueError('Need a force field name')
-    file_paths = get_forcefield_paths()
-    try:
-        ff_path = next(val for val in file_paths if name in val)
-    except StopIteration:
+    ff_path = get_forcefield_index().get(name)
+    if ff_path is None:
         raise ValueError('Could not find force field with name {}'
                 ' in path {}'.format(name, get_ff_path()))
+    with _FORCEFIELD_LOCK:
+        forcefield = _FORCEFIELDS.get(name)
+        if forcefield is None and compiled:
+            header = _compiled_header(ff_path)
+            forcefield = _load_compiled(_compiled_path(name, header), header)
+        if forcefield is None:
+            forcefield = _parse_forcefield(ff_path)
+        _FORCEFIELDS[name] = forcefield
+    return forcefield
+
+def compile_forcefield(name):
+    """Create the compiled form of a bundled force field, unless an
+    up to date one exists, and return the force field.
+
+    The compiled form is the parsed foyer.Forcefield (atom types,
+    SMARTS trees and parameter tables) pickled to a file in the
+    ANTEFOYER_FF_CACHE_DIR directory (default: ~/.cache/antefoyer).
+    It is only used if it matches the SHA-256 hash of the XML file,
+    the foyer version and the Python version, and if the file and
+    its directory belong to the current user and are not writable
+    by anyone else. Call this function at install or deployment time
+    to opt in; `get_forcefield` only reads the compiled form.
+
+    Returns
+    -------
+    forcefield : foyer.Forcefield
+    """
+    ff_path = get_forcefield_index().get(name)
+    if ff_path is None:
+        raise ValueError('Could not find force field with name {}'
+                ' in path {}'.format(name, get_ff_path()))
+    header = _compiled_header(ff_path)
+    compiled_path = _compiled_path(name, header)
+
+    forcefield = _load_compiled(compiled_path, header)
+    if forcefield is None:
+        forcefield = _parse_forcefield(ff_path)
+        _store_compiled(compiled_path, header, forcefield)
+    return forcefield
+
+def get_ff_cache_dir():
+    cache_dir = os.environ.get(FF_CACHE_DIR_ENV)
+    if not cache_dir:
+        cache_root = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(cache_root, 'antefoyer')
+    return os.path.join(cache_dir, 'forcefields')
+
+def _parse_forcefield(ff_path):
+    from foyer import Forcefield
     return Forcefield(forcefield_files=str(ff_path))
 
+def _compiled_header(ff_path):
+    import foyer
+    with open(ff_path, 'rb') as xml_file:
+        xml_hash = hashlib.sha256(xml_file.read()).hexdigest()
+    return {
+        'format': _COMPILED_FORMAT,
+        'xml_sha256': xml_hash,
+        'foyer': getattr(foyer, '__version__', 'unknown'),
+        'python': list(sys.version_info[:2]),
+    }
+
+def _compiled_path(name, header):
+    return os.path.join(get_ff_cache_dir(), '{}-{}.pkl'.format(
+        name, header['xml_sha256'][:16]))
+
+def _is_private(path):
+    """Whether path belongs to the current user and cannot be
+    written by anyone else.
+    """
+    if not hasattr(os, 'getuid'):
+        return True
+    stat = os.stat(path)
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+def _load_compiled(compiled_path, header):
+    """Unpickle a compiled force field, or return None if it is
+    missing, stale, unreadable or could have been written by another
+    user. The header is read and checked before the force field
+    itself.
+    """
+    try:
+        if not (_is_private(compiled_path)
+                and _is_private(os.path.dirname(compiled_path))):
+            warnings.warn('Ignoring compiled force field {}: it may be '
+                    'modified by other users'.format(compiled_path))
+            return None
+        with open(compiled_path, 'rb') as compiled_file:
+            if pickle.load(compiled_file) != header:
+                return None
+            return pickle.load(compiled_file)
+    except Exception:
+        return None
+
+def _store_compiled(compiled_path, header, forcefield):
+    """Atomically write a compiled force field. Failure to write the
+    file (e.g., a read-only cache directory) only costs speed, but a
+    force field that cannot be pickled is an error.
+    """
+    compiled_dir = os.path.dirname(compiled_path)
+    try:
+        os.makedirs(compiled_dir, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=compiled_dir, suffix='.tmp')
+    except OSError as error:
+        warnings.warn('Could not write compiled force field: {}'.format(error))
+        return
+    try:
+        with os.fdopen(fd, 'wb') as compiled_file:
+            pickle.dump(header, compiled_file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(forcefield, compiled_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, compiled_path)
+    except OSError as error:
+        os.remove(tmp_path)
+        warnings.warn('Could not write compiled force field: {}'.format(error))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def clear_forcefield_cache(name=None):
+    """Forget cached force fields so they are parsed again.
+
+    Parameters
+    ----------
+    name : str, optional, default=None
+        Force field to forget. If None, all cached force fields and
+        the index of XML files are cleared.
+    """
+    with _FORCEFIELD_LOCK:
+        if name is None:
+            _FORCEFIELDS.clear()
+            _FORCEFIELD_INDEX.clear()
+        else:
+            _FORCEFIELDS.pop(name, None)
+
 def load_GAFF():
     return get_forcefield(name='gaff')
-
@@ -0,0 +1,10 @@
+"""
+Helpers for testing and benchmarking antefoyer without AmberTools.
+"""
+import os
+
+# Stand-in for the antechamber executable. Select it by setting the
+# ANTEFOYER_ANTECHAMBER environment variable to this path.
+FAKE_ANTECHAMBER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "bin", "antechamber"
+)
@@ -0,0 +1,90 @@
+"""
+Fixtures shared by the antefoyer tests.
+"""
+
+import os
+import shutil
+
+import parmed as pmd
+import pytest
+
+
+@pytest.fixture
+def fake_antechamber(monkeypatch, tmp_path):
+    """Run the antechamber stand-in of antefoyer.testing, in the main
+    process and in worker processes.
+    """
+    import antefoyer.antefoyer
+    from antefoyer.testing import FAKE_ANTECHAMBER
+
+    # The stand-in is a python3 script that is run through its #! line
+    if os.name != "posix" or shutil.which("python3") is None:
+        pytest.skip("the stand-in needs a POSIX system with python3 on PATH")
+
+    # Failed runs write ante_errorlog_*.txt to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(antefoyer.antefoyer, "ANTECHAMBER", FAKE_ANTECHAMBER)
+    monkeypatch.setenv("ANTEFOYER_ANTECHAMBER", FAKE_ANTECHAMBER)
+    for name in (
+        "ANTEFOYER_FAKE_LATENCY",
+        "ANTEFOYER_FAKE_FAILURE",
+        "ANTEFOYER_FAKE_FAILURE_RATE",
+    ):
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+@pytest.fixture
+def ethane():
+    from foyer.tests.utils import get_fn
+
+    return pmd.load_file(get_fn("ethane.mol2"), structure=True)
+
+
+@pytest.fixture
+def ethanes(ethane):
+    """Factory of n copies of ethane, each shifted a little further,
+    so that no two copies share a cache entry.
+    """
+
+    def shifted_copies(n_copies):
+        copies = []
+        for shift in range(n_copies):
+            molecule = ethane.copy(pmd.Structure)
+            molecule.coordinates = ethane.coordinates + 0.01 * shift
+            copies.append(molecule)
+        return copies
+
+    return shifted_copies
+
+
+def polyethylene_chain(n_carbons):
+    """Linear polyethylene chain with a zig-zag carbon backbone and
+    one residue per carbon. Ethane for n_carbons=2; the chain has
+    3 * n_carbons + 2 atoms.
+    """
+    chain = pmd.Structure()
+    previous = None
+    for idx in range(n_carbons):
+        end = idx in (0, n_carbons - 1)
+        resname = "END" if end else "CH2"
+        carbon = pmd.Atom(name="C", atomic_number=6)
+        chain.add_atom(carbon, resname, idx)
+        carbon.xx, carbon.xy, carbon.xz = 1.26 * idx, 0.89 * (idx % 2), 0.0
+        if previous is not None:
+            chain.bonds.append(pmd.Bond(previous, carbon))
+        for h_idx in range(3 if end else 2):
+            hydrogen = pmd.Atom(name="H{}".format(h_idx), atomic_number=1)
+            chain.add_atom(hydrogen, resname, idx)
+            hydrogen.xx = carbon.xx + 0.3 * (h_idx - 1)
+            hydrogen.xy = carbon.xy + (1.0 if idx % 2 else -1.0)
+            hydrogen.xz = 0.6 * (h_idx - 0.5)
+            chain.bonds.append(pmd.Bond(carbon, hydrogen))
+        previous = carbon
+    return chain
+
+
+@pytest.fixture
+def polyethylene():
+    """Factory of polyethylene chains by number of carbons."""
+    return polyethylene_chain
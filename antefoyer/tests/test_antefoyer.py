@@ -15,11 +15,12 @@ from foyer.exceptions import FoyerError
 from antefoyer.utils.tempdir import temporary_directory
 from antefoyer.utils.tempdir import temporary_cd
 
-from distutils.spawn import find_executable
+from antefoyer.antefoyer import ANTECHAMBER
+import glob
+import os
+import re
 from os.path import isfile
 
-ANTECHAMBER = find_executable("antechamber")
-
 
 @pytest.mark.skipif(ANTECHAMBER is not None, reason="antechamber is installed")
 def test_check_antechamber():
@@ -87,7 +88,26 @@ def test_ante_error():
         with temporary_cd(tmpdir):
             with pytest.raises(RuntimeError, match=r"Antechamber failed"):
                 charges = ante_charges(ethane, "bcc", net_charge=-1)
-            assert isfile("ante_errorlog.txt")
+            assert len(glob.glob("ante_errorlog_*.txt")) == 1
+
+
+def test_concurrent_error_logs(fake_antechamber, ethanes, tmp_path):
+    fake_antechamber.setenv("ANTEFOYER_FAKE_FAILURE", "fatal")
+    results = ante_charges_batch(
+        ethanes(4),
+        "bcc",
+        n_procs=4,
+        use_threads=True,
+        return_exceptions=True,
+        cache_dir=False,
+    )
+    # Every failure names a log file of its own
+    logs = [re.search(r"See '(.*)'", str(result)).group(1) for result in results]
+    assert len(set(logs)) == 4
+    for log in logs:
+        assert os.path.dirname(log) == str(tmp_path)
+        with open(log) as log_file:
+            assert "Fatal Error" in log_file.read()
 
 
 @pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
@@ -98,8 +118,390 @@ def test_ante_charge_delta():
     assert np.allclose(sum([i.charge for i in charges]), 0)
 
 
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_charges_numbered_hydrogen_names():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    for idx, atom in enumerate(ethane.atoms[2:]):
+        atom.name = "{}HB".format(idx % 3 + 1)
+    charges = ante_charges(ethane, "bcc", cache_dir=False)
+    assert np.allclose(sum([i.charge for i in charges]), 0)
+
+
 @pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
 def test_charge_tolerance():
     with pytest.raises(ValueError, match=r"The sum of charges"):
         ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
         ante_charges(ethane, "bcc", charge_tol=0.001)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_atomtyping_batch():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    typed = ante_atomtyping_batch([ethane, ethane, ethane], "gaff", n_procs=2)
+    assert len(typed) == 3
+    for molecule in typed:
+        assert sum((1 for at in molecule.atoms if at.type == "c3")) == 2
+        assert sum((1 for at in molecule.atoms if at.type == "hc")) == 6
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_charges_batch():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    charged = ante_charges_batch([ethane, ethane], "bcc", n_procs=2)
+    assert len(charged) == 2
+    for molecule in charged:
+        assert np.allclose(sum([i.charge for i in molecule]), 0)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_charges_batch_net_charge_length():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    with pytest.raises(ValueError, match=r"Length of net_charge"):
+        ante_charges_batch([ethane, ethane], "bcc", net_charge=[0.0])
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_charges_conformers():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    xyz = ethane.coordinates
+    conformers = np.array([xyz, xyz * 1.01, xyz * 0.99])
+    charges, conformer_charges = ante_charges_conformers(
+        ethane, "bcc", coordinates=conformers, n_procs=3
+    )
+    assert charges.shape == (len(ethane.atoms),)
+    assert conformer_charges.shape == (3, len(ethane.atoms))
+    assert np.allclose(charges.sum(), 0)
+    assert np.allclose(charges, conformer_charges.mean(axis=0), atol=1e-3)
+
+    with pytest.raises(ValueError, match=r"coordinates must have shape"):
+        ante_charges_conformers(ethane, "bcc", coordinates=xyz)
+    with pytest.raises(ValueError, match=r"template is not supported"):
+        ante_charges_conformers(ethane, "bcc", coordinates=conformers, template=True)
+    for name in ("return_structure", "correct_net_charge"):
+        with pytest.raises(ValueError, match=r"{} cannot be set".format(name)):
+            ante_charges_conformers(ethane, "bcc", **{name: False})
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_cached_charges(monkeypatch, tmp_path):
+    import antefoyer.antefoyer
+
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    charges = ante_charges(ethane, "bcc", cache_dir=str(tmp_path))
+    expected = [atom.charge for atom in charges]
+
+    def no_subprocess(*args, **kwargs):
+        raise AssertionError("antechamber should not be called")
+
+    monkeypatch.setattr(antefoyer.antefoyer, "Popen", no_subprocess)
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    charges = ante_charges(ethane, "bcc", cache_dir=str(tmp_path))
+    assert np.allclose([atom.charge for atom in charges], expected)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_reuse_am1_calculation(monkeypatch, tmp_path):
+    import antefoyer.antefoyer
+
+    if antefoyer.antefoyer._am1bcc() is None:
+        pytest.skip("am1bcc is not installed")
+
+    runs = []
+    run_antechamber = antefoyer.antefoyer._run_antechamber
+
+    def record_runs(command, *args, **kwargs):
+        runs.append(os.path.basename(command[0]))
+        return run_antechamber(command, *args, **kwargs)
+
+    monkeypatch.setattr(antefoyer.antefoyer, "_run_antechamber", record_runs)
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    mul = ante_charges(ethane, "mul", cache_dir=str(tmp_path), return_structure=False)
+    assert runs == ["antechamber"]
+    bcc = ante_charges(ethane, "bcc", cache_dir=str(tmp_path), return_structure=False)
+    # Only the bond charge corrections are computed, sqm does not run again
+    assert runs == ["antechamber", "am1bcc"]
+    assert np.allclose(mul.sum(), 0)
+    assert np.allclose(bcc.sum(), 0)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_cached_atypes(monkeypatch, tmp_path):
+    import antefoyer.antefoyer
+
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    ante_atomtyping(ethane, "gaff", cache_dir=str(tmp_path))
+
+    def no_subprocess(*args, **kwargs):
+        raise AssertionError("antechamber should not be called")
+
+    monkeypatch.setattr(antefoyer.antefoyer, "Popen", no_subprocess)
+    typed = ante_atomtyping(ethane, "gaff", cache_dir=str(tmp_path))
+    assert sum((1 for at in typed.atoms if at.type == "c3")) == 2
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_cached_atypes_keep_geometry(tmp_path):
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    ante_atomtyping(ethane, "gaff", cache_dir=str(tmp_path))
+
+    shifted = ethane.copy(pmd.Structure)
+    shifted.coordinates = ethane.coordinates + 5.0
+    shifted.atoms[0].name = "CX"
+    typed = ante_atomtyping(shifted, "gaff", cache_dir=str(tmp_path))
+    assert np.allclose(typed.coordinates, shifted.coordinates)
+    assert typed.atoms[0].name == "CX"
+    assert [atom.type for atom in typed.atoms] == ["c3", "c3"] + ["hc"] * 6
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_cold_and_warm_atypes_match(tmp_path):
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    cold = ante_atomtyping(ethane, "gaff", cache_dir=str(tmp_path))
+    warm = ante_atomtyping(ethane, "gaff", cache_dir=str(tmp_path))
+    for typed in (cold, warm):
+        assert [at.name for at in typed.atoms] == [at.name for at in ethane.atoms]
+        assert [at.residue.name for at in typed.atoms] == [
+            at.residue.name for at in ethane.atoms
+        ]
+        assert np.array_equal(typed.coordinates, ethane.coordinates)
+        assert len(typed.bonds) == len(ethane.bonds)
+    assert [at.type for at in cold.atoms] == [at.type for at in warm.atoms]
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_system_atypes():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    system = ethane * 5
+    typed = ante_atomtyping(system, "gaff", system=True)
+    assert len(typed.atoms) == 40
+    assert sum((1 for at in typed.atoms if at.type == "c3")) == 10
+    assert sum((1 for at in typed.atoms if at.type == "hc")) == 30
+    assert all(at.id == at.type for at in typed.atoms)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_system_charges():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    system = ethane * 5
+    charges = ante_charges(system, "bcc", net_charge={"C2H6": 0.0}, system=True)
+    assert np.allclose(sum([i.charge for i in charges]), 0)
+    assert np.allclose(
+        [i.charge for i in charges.atoms[:8]], [i.charge for i in charges.atoms[32:]]
+    )
+
+
+def test_write_pdb_conect():
+    from antefoyer.antefoyer import _write_pdb
+
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    with temporary_directory() as tmpdir:
+        with temporary_cd(tmpdir):
+            _write_pdb(ethane, "ethane.pdb")
+            with open("ethane.pdb") as pdb:
+                conect = [line.split()[1:] for line in pdb if line.startswith("CONECT")]
+    assert len(conect) == 8
+    assert conect[0] == ["1", "2", "3", "4", "5"]
+    assert conect[1] == ["2", "1", "6", "7", "8"]
+    assert conect[2] == ["3", "1"]
+
+
+def test_write_mol2_bond_orders():
+    from antefoyer.antefoyer import _write_mol2
+
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    ethane.bonds[0].order = 2.0
+    with temporary_directory() as tmpdir:
+        with temporary_cd(tmpdir):
+            _write_mol2(ethane, "ethane.mol2")
+            written = pmd.load_file("ethane.mol2", structure=True)
+    assert len(written.atoms) == 8
+    assert len(written.bonds) == 7
+    assert written.bonds[0].order == 2.0
+    assert np.allclose(written.coordinates, ethane.coordinates)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_trust_bond_orders_requires_mol2():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    with pytest.raises(FoyerError, match=r"Bond orders can only be passed"):
+        ante_atomtyping(ethane, "gaff", trust_bond_orders=True)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_return_arrays():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    types = ante_atomtyping(ethane, "gaff", return_structure=False)
+    assert list(types) == ["c3", "c3", "hc", "hc", "hc", "hc", "hc", "hc"]
+
+    original = [atom.charge for atom in ethane.atoms]
+    charges = ante_charges(ethane, "bcc", return_structure=False)
+    assert isinstance(charges, np.ndarray)
+    assert np.allclose(charges.sum(), 0)
+    assert [atom.charge for atom in ethane.atoms] == original
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_threaded_batch():
+    import os
+
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    cwd = os.getcwd()
+    typed = ante_atomtyping_batch(
+        [ethane] * 8, "gaff", n_procs=4, use_threads=True, return_structure=False
+    )
+    charges = ante_charges_batch(
+        [ethane] * 8, "bcc", n_procs=4, use_threads=True, return_structure=False
+    )
+    assert os.getcwd() == cwd
+    assert ethane.box is None
+    for molecule_types, molecule_charges in zip(typed, charges):
+        assert list(molecule_types[:2]) == ["c3", "c3"]
+        assert np.allclose(molecule_charges.sum(), 0)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_async_api():
+    import asyncio
+
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+
+    async def run():
+        semaphore = asyncio.Semaphore(2)
+        typed = ante_atomtyping_async(ethane, "gaff", semaphore=semaphore)
+        charges = [
+            ante_charges_async(ethane, "bcc", semaphore=semaphore, return_structure=False)
+            for _ in range(4)
+        ]
+        return await asyncio.gather(typed, *charges)
+
+    typed, *charges = asyncio.run(run())
+    assert sum((1 for at in typed.atoms if at.type == "c3")) == 2
+    for molecule_charges in charges:
+        assert np.allclose(molecule_charges.sum(), 0)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_async_steps_off_loop(tmpdir, monkeypatch):
+    import asyncio
+    import threading
+
+    import antefoyer.antefoyer
+
+    # The version probe and the input and output files must not block
+    # the event loop
+    threads = []
+    for name in ("_antechamber_version", "_write_input", "_read_charges"):
+        function = getattr(antefoyer.antefoyer, name)
+
+        def record(*args, _function=function, **kwargs):
+            threads.append(threading.get_ident())
+            return _function(*args, **kwargs)
+
+        monkeypatch.setattr(antefoyer.antefoyer, name, record)
+
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    asyncio.run(ante_charges_async(ethane, "bcc", cache_dir=str(tmpdir)))
+    assert len(threads) == 3
+    assert threading.get_ident() not in threads
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_async_ante_error(tmp_path, monkeypatch):
+    import asyncio
+
+    monkeypatch.chdir(tmp_path)
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    with pytest.raises(RuntimeError, match=r"Antechamber failed"):
+        asyncio.run(ante_charges_async(ethane, "bcc", net_charge=-1))
+    assert len(glob.glob("ante_errorlog_*.txt")) == 1
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="requires process groups")
+def test_timeout_kills_process_group(tmp_path):
+    import time
+    from antefoyer.antefoyer import _run_antechamber
+    from antefoyer.exceptions import AntechamberTimeoutError
+
+    command = ["sh", "-c", "sleep 30 & echo $! > child.pid; wait"]
+    start = time.monotonic()
+    with pytest.raises(AntechamberTimeoutError):
+        _run_antechamber(
+            command, str(tmp_path), str(tmp_path), deadline=time.monotonic() + 0.5
+        )
+    assert time.monotonic() - start < 10
+
+    child = int((tmp_path / "child.pid").read_text())
+    for _ in range(50):
+        try:
+            os.kill(child, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail("child process was not killed")
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="requires process groups")
+def test_cancel_antechamber_run(tmp_path):
+    import threading
+    from antefoyer.antefoyer import _run_antechamber
+    from antefoyer.exceptions import AntechamberCancelledError
+
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    with pytest.raises(AntechamberCancelledError):
+        _run_antechamber(["sleep", "30"], str(tmp_path), str(tmp_path), cancel=cancel)
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="requires process groups")
+def test_cancel_async_run_reaps_process(tmp_path, monkeypatch):
+    import asyncio
+
+    import antefoyer.antefoyer
+
+    procs = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def record_process(*args, **kwargs):
+        procs.append(await create_subprocess_exec(*args, **kwargs))
+        return procs[-1]
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", record_process)
+
+    async def run():
+        task = asyncio.ensure_future(
+            antefoyer.antefoyer._run_antechamber_async(
+                ["sleep", "30"], str(tmp_path), str(tmp_path)
+            )
+        )
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The killed process has been waited for
+        return procs[0].returncode
+
+    assert asyncio.run(run()) is not None
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_parametrize():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    typed = ante_parametrize(ethane, "gaff", "bcc")
+    assert sum((1 for at in typed.atoms if at.type == "c3")) == 2
+    assert sum((1 for at in typed.atoms if at.id == "hc")) == 6
+    assert np.allclose(sum([i.charge for i in typed]), 0)
+    assert np.allclose(typed.coordinates, ethane.coordinates)
+    assert [at.name for at in typed.atoms] == [at.name for at in ethane.atoms]
+
+    types, charges = ante_parametrize(ethane, "gaff2", "bcc", return_structure=False)
+    assert len(types) == len(charges) == 8
+    assert np.allclose(charges.sum(), 0)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_parametrize_system():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    typed = ante_parametrize(ethane * 3, "gaff", "bcc", system=True)
+    assert sum((1 for at in typed.atoms if at.type == "c3")) == 6
+    assert np.allclose(sum([i.charge for i in typed]), 0)
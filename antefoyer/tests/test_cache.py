@@ -0,0 +1,46 @@
+"""
+Unit tests for the antefoyer result cache.
+"""
+
+import os
+
+from antefoyer.utils.cache import cache_key, get_cache_dir
+from antefoyer.utils.cache import load_cached, store_cached
+from antefoyer.utils.cache import load_metadata, store_metadata
+
+
+def test_cache_key_field_order():
+    key1 = cache_key(task="charges", charge_style="bcc", net_charge=0.0)
+    key2 = cache_key(net_charge=0.0, task="charges", charge_style="bcc")
+    key3 = cache_key(task="charges", charge_style="mul", net_charge=0.0)
+    assert key1 == key2
+    assert key1 != key3
+
+
+def test_get_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv("ANTEFOYER_CACHE_DIR", raising=False)
+    assert get_cache_dir() is None
+    monkeypatch.setenv("ANTEFOYER_CACHE_DIR", str(tmp_path))
+    assert get_cache_dir() == str(tmp_path)
+    assert get_cache_dir(False) is None
+
+
+def test_store_and_load(tmp_path):
+    key = cache_key(task="atomtyping")
+    assert load_cached(str(tmp_path), key) is None
+
+    result = tmp_path / "ante_out.mol2"
+    result.write_text("@<TRIPOS>MOLECULE\n")
+    store_cached(str(tmp_path), key, str(result))
+
+    cached = load_cached(str(tmp_path), key)
+    assert cached is not None
+    with open(cached) as cached_file:
+        assert cached_file.read() == "@<TRIPOS>MOLECULE\n"
+    assert not [f for f in os.listdir(os.path.dirname(cached)) if f.endswith(".tmp")]
+
+
+def test_metadata_roundtrip(tmp_path):
+    assert load_metadata(str(tmp_path), "versions") == {}
+    store_metadata(str(tmp_path), "versions", {"antechamber": "22.0"})
+    assert load_metadata(str(tmp_path), "versions") == {"antechamber": "22.0"}
@@ -0,0 +1,56 @@
+"""
+Tests for the antechamber stand-in in antefoyer.testing.
+"""
+
+import numpy as np
+import pytest
+
+import antefoyer.antefoyer
+from antefoyer.antefoyer import ante_atomtyping, ante_charges, ante_charges_batch
+from antefoyer.exceptions import AntechamberTimeoutError
+from antefoyer.testing import FAKE_ANTECHAMBER
+
+
+def test_discovery(monkeypatch):
+    monkeypatch.delattr(antefoyer.antefoyer, "ANTECHAMBER", raising=False)
+    monkeypatch.setenv("ANTEFOYER_ANTECHAMBER", FAKE_ANTECHAMBER)
+    assert antefoyer.antefoyer._antechamber() == FAKE_ANTECHAMBER
+
+
+def test_deterministic(fake_antechamber, ethane):
+    typed = ante_atomtyping(ethane, "gaff")
+    assert [atom.type for atom in typed.atoms] == ["c3", "c3"] + ["hc"] * 6
+
+    charges = ante_charges(ethane, "bcc", cache_dir=False)
+    assert np.allclose(charges.atoms[0].charge, -0.135, atol=0.001)
+    again = ante_charges(ethane, "bcc", cache_dir=False)
+    assert [atom.charge for atom in charges.atoms] == [
+        atom.charge for atom in again.atoms
+    ]
+
+
+def test_fatal(fake_antechamber, ethane):
+    fake_antechamber.setenv("ANTEFOYER_FAKE_FAILURE", "fatal")
+    with pytest.raises(RuntimeError, match="Antechamber failed"):
+        ante_charges(ethane, "bcc", cache_dir=False)
+
+
+def test_latency_timeout(fake_antechamber, ethane):
+    fake_antechamber.setenv("ANTEFOYER_FAKE_LATENCY", "5")
+    with pytest.raises(AntechamberTimeoutError):
+        ante_charges(ethane, "bcc", cache_dir=False, timeout=0.5)
+
+
+def test_failure_rate(fake_antechamber, ethanes):
+    fake_antechamber.setenv("ANTEFOYER_FAKE_FAILURE_RATE", "0.5")
+    molecules = ethanes(8)
+
+    results = ante_charges_batch(
+        molecules, "bcc", use_threads=True, return_exceptions=True, cache_dir=False
+    )
+    failed = [isinstance(result, RuntimeError) for result in results]
+    again = ante_charges_batch(
+        molecules, "bcc", use_threads=True, return_exceptions=True, cache_dir=False
+    )
+    assert failed == [isinstance(result, RuntimeError) for result in again]
+    assert 0 < sum(failed) < len(molecules)
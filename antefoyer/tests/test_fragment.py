@@ -0,0 +1,101 @@
+"""
+Tests for cutting molecules into fragments for charging.
+"""
+
+import numpy as np
+import parmed as pmd
+import pytest
+
+from antefoyer.antefoyer import ANTECHAMBER, ante_atomtyping, ante_charges
+from antefoyer.utils.fragment import capped_fragment, cuttable_bonds, partition
+from antefoyer.utils.fragment import repeat_units
+
+
+def test_cuttable_bonds(polyethylene):
+    butane = polyethylene(4)
+    cuttable = cuttable_bonds(butane)
+    cut = {tuple(sorted((b.atom1.idx, b.atom2.idx))) for b, c in zip(butane.bonds, cuttable) if c}
+    # Only the central C-C bond leaves no methyl hydride behind
+    assert cut == {(4, 7)}
+
+    # No cuts inside a ring
+    cyclohexane = polyethylene(6)
+    carbons = [atom for atom in cyclohexane.atoms if atom.element == 6]
+    cyclohexane.bonds.append(pmd.Bond(carbons[0], carbons[-1]))
+    assert not cuttable_bonds(cyclohexane).any()
+
+
+def test_partition(polyethylene):
+    alkane = polyethylene(30)
+    labels, cut_bonds = partition(alkane, 20)
+    counts = np.bincount(labels)
+    n_caps = np.bincount(labels[cut_bonds.ravel()], minlength=len(counts))
+    assert len(counts) > 1
+    assert np.all(counts + n_caps <= 20)
+    for atom1, atom2 in cut_bonds:
+        assert alkane.atoms[atom1].element == alkane.atoms[atom2].element == 6
+
+    # Small enough to charge whole
+    labels, cut_bonds = partition(alkane, 1000)
+    assert not labels.any()
+    assert len(cut_bonds) == 0
+
+
+def test_capped_fragment(polyethylene):
+    alkane = polyethylene(10)
+    labels, cut_bonds = partition(alkane, 15)
+    atom_indices = np.flatnonzero(labels == 0)
+    fragment, capped = capped_fragment(alkane, atom_indices, cut_bonds)
+    assert len(fragment.atoms) == len(atom_indices) + len(capped)
+    for cap, anchor in zip(fragment.atoms[len(atom_indices) :], capped):
+        assert cap.element == 1
+        assert cap in fragment.atoms[anchor].bond_partners
+        distance = np.linalg.norm(
+            [cap.xx - fragment.atoms[anchor].xx, cap.xy - fragment.atoms[anchor].xy]
+        )
+        assert distance == pytest.approx(1.09, abs=1e-3)
+
+
+def test_repeat_units(polyethylene):
+    chain = polyethylene(50)
+    units, cut_bonds = repeat_units(chain)
+    # The two identical end groups and the middle unit
+    assert len(cut_bonds) == 49
+    assert [len(copies) for _, copies in units] == [2, 48]
+    assert len(units[0][0]) == 4
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_template(monkeypatch, polyethylene):
+    import antefoyer.antefoyer
+
+    runs = []
+    run_antechamber = antefoyer.antefoyer._run_antechamber
+
+    def count_runs(*args, **kwargs):
+        runs.append(args)
+        return run_antechamber(*args, **kwargs)
+
+    monkeypatch.setattr(antefoyer.antefoyer, "_run_antechamber", count_runs)
+    chain = polyethylene(50)
+    typed = ante_atomtyping(chain, "gaff", template=True, cache_dir=False)
+    assert len(runs) == 2
+    assert len(typed.atoms) == len(chain.atoms)
+    assert all(atom.type in ("c3", "hc") for atom in typed.atoms)
+
+    charges = ante_charges(
+        chain, "bcc", template=True, cache_dir=False, return_structure=False
+    )
+    assert len(runs) == 4
+    assert charges.sum() == pytest.approx(0.0, abs=1e-8)
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_fragment_charges(polyethylene):
+    alkane = polyethylene(30)
+    charges = ante_charges(alkane, "bcc", fragment_size=12, return_structure=False)
+    assert len(charges) == len(alkane.atoms)
+    assert charges.sum() == pytest.approx(0.0, abs=1e-8)
+
+    with pytest.raises(ValueError, match="formal charges"):
+        ante_charges(alkane, "bcc", net_charge=-1.0, fragment_size=20)
@@ -0,0 +1,143 @@
+"""
+Unit tests for the GAFF force field registry.
+"""
+
+import os
+
+import pytest
+
+from antefoyer.gafffoyer import clear_forcefield_cache, get_forcefield
+from antefoyer.gafffoyer import get_forcefield_index, load_GAFF
+
+
+class FakeForcefield(object):
+    """Stand-in for foyer.Forcefield that records each XML parse."""
+
+    loaded = []
+
+    def __init__(self, forcefield_files=None):
+        self.loaded.append(forcefield_files)
+
+
+@pytest.fixture
+def fake_forcefield(monkeypatch, tmp_path):
+    import foyer
+
+    monkeypatch.setattr(foyer, "Forcefield", FakeForcefield, raising=False)
+    monkeypatch.setenv("ANTEFOYER_FF_CACHE_DIR", str(tmp_path))
+    FakeForcefield.loaded = []
+    clear_forcefield_cache()
+    yield FakeForcefield.loaded
+    clear_forcefield_cache()
+
+
+def test_forcefield_index():
+    index = get_forcefield_index()
+    assert "gaff" in index
+    assert index["gaff"].endswith("gaff.xml")
+
+
+def test_forcefield_exact_name():
+    with pytest.raises(ValueError, match=r"Could not find force field"):
+        get_forcefield("gaf")
+    with pytest.raises(ValueError, match=r"Need a force field name"):
+        get_forcefield()
+
+
+def test_forcefield_cached(fake_forcefield):
+    gaff = load_GAFF()
+    assert load_GAFF() is gaff
+    assert get_forcefield("gaff") is gaff
+    assert len(fake_forcefield) == 1
+
+    clear_forcefield_cache("gaff")
+    assert get_forcefield("gaff", compiled=False) is not gaff
+    assert len(fake_forcefield) == 2
+
+
+def test_compiled_forcefield(fake_forcefield, monkeypatch, tmp_path):
+    import foyer
+    from antefoyer.gafffoyer import compile_forcefield
+
+    # A plain load does not write the compiled form
+    load_GAFF()
+    assert not (tmp_path / "forcefields").exists()
+    assert len(fake_forcefield) == 1
+
+    clear_forcefield_cache()
+    compile_forcefield("gaff")
+    assert len(fake_forcefield) == 2
+    assert len(list((tmp_path / "forcefields").glob("gaff-*.pkl"))) == 1
+
+    # A fresh load uses the compiled form instead of the XML file
+    clear_forcefield_cache()
+    load_GAFF()
+    assert len(fake_forcefield) == 2
+
+    # A different foyer version invalidates the compiled form
+    monkeypatch.setattr(foyer, "__version__", "0.0.0-test", raising=False)
+    clear_forcefield_cache()
+    load_GAFF()
+    assert len(fake_forcefield) == 3
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="needs POSIX permissions")
+def test_compiled_forcefield_permissions(fake_forcefield, tmp_path):
+    from antefoyer.gafffoyer import compile_forcefield
+
+    compile_forcefield("gaff")
+    compiled, = (tmp_path / "forcefields").glob("gaff-*.pkl")
+    compiled.chmod(0o666)
+
+    # Anyone could have replaced it, so it is not unpickled
+    clear_forcefield_cache()
+    with pytest.warns(UserWarning, match="modified by other users"):
+        load_GAFF()
+    assert len(fake_forcefield) == 2
+
+
+def _foyer_forcefield():
+    """foyer.Forcefield, or skip the test if foyer cannot parse GAFF."""
+    foyer = pytest.importorskip("foyer")
+    Forcefield = getattr(foyer, "Forcefield", None)
+    if Forcefield is None:
+        pytest.skip("foyer is not installed")
+    try:
+        return Forcefield(forcefield_files=get_forcefield_index()["gaff"])
+    except Exception as error:
+        pytest.skip("foyer cannot load GAFF: {}".format(error))
+
+
+def test_compiled_gaff_applies_like_parsed(monkeypatch, tmp_path):
+    import parmed as pmd
+    from foyer.tests.utils import get_fn
+    from antefoyer.gafffoyer import compile_forcefield
+
+    parsed = _foyer_forcefield()
+    monkeypatch.setenv("ANTEFOYER_FF_CACHE_DIR", str(tmp_path))
+    clear_forcefield_cache()
+    compile_forcefield("gaff")
+    clear_forcefield_cache()
+    compiled = compile_forcefield("gaff")
+    clear_forcefield_cache()
+    assert compiled is not parsed
+
+    # ethane.mol2 carries GAFF atom types, which GAFF reads from atom.id
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    for atom in ethane.atoms:
+        atom.id = atom.type
+    expected = parsed.apply(ethane.copy(pmd.Structure))
+    result = compiled.apply(ethane.copy(pmd.Structure))
+
+    assert [atom.type for atom in result.atoms] == [
+        atom.type for atom in expected.atoms
+    ]
+    assert [(bond.type.k, bond.type.req) for bond in result.bonds] == [
+        (bond.type.k, bond.type.req) for bond in expected.bonds
+    ]
+    assert [(angle.type.k, angle.type.theteq) for angle in result.angles] == [
+        (angle.type.k, angle.type.theteq) for angle in expected.angles
+    ]
+    assert len(result.rb_torsions) + len(result.dihedrals) == len(
+        expected.rb_torsions
+    ) + len(expected.dihedrals)
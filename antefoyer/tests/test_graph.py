@@ -0,0 +1,69 @@
+"""
+Tests for the array-backed connectivity engine.
+"""
+
+import numpy as np
+
+from antefoyer.utils.graph import bridges, component_atoms, connected_components
+
+
+def test_connected_components():
+    bonds = np.array([[4, 5], [0, 1], [5, 2], [6, 7], [8, 3]])
+    n_components, labels = connected_components(9, bonds)
+    assert n_components == 4
+    assert labels.tolist() == [0, 0, 1, 2, 1, 1, 3, 3, 2]
+    components = component_atoms(labels)
+    assert [c.tolist() for c in components] == [[0, 1], [2, 4, 5], [3, 8], [6, 7]]
+
+
+def test_no_bonds():
+    n_components, labels = connected_components(3, np.empty((0, 2), dtype=int))
+    assert n_components == 3
+    assert labels.tolist() == [0, 1, 2]
+    assert connected_components(0, [])[0] == 0
+    assert component_atoms(np.array([], dtype=int)) == []
+
+
+def test_long_chain():
+    # Bonds in reverse order is the worst case for simple label propagation
+    n_atoms = 100000
+    bonds = np.column_stack([np.arange(n_atoms - 1), np.arange(1, n_atoms)])[::-1]
+    n_components, labels = connected_components(n_atoms, bonds)
+    assert n_components == 1
+    assert not labels.any()
+
+
+def test_random_graph():
+    rng = np.random.RandomState(0)
+    n_atoms = 2000
+    bonds = rng.randint(n_atoms, size=(1500, 2))
+    n_components, labels = connected_components(n_atoms, bonds)
+
+    # Reference: depth-first search
+    neighbors = [[] for _ in range(n_atoms)]
+    for atom1, atom2 in bonds:
+        neighbors[atom1].append(atom2)
+        neighbors[atom2].append(atom1)
+    expected = -np.ones(n_atoms, dtype=int)
+    n_expected = 0
+    for start in range(n_atoms):
+        if expected[start] >= 0:
+            continue
+        stack = [start]
+        expected[start] = n_expected
+        while stack:
+            for atom in neighbors[stack.pop()]:
+                if expected[atom] < 0:
+                    expected[atom] = n_expected
+                    stack.append(atom)
+        n_expected += 1
+    assert n_components == n_expected
+    assert np.array_equal(labels, expected)
+
+
+def test_bridges():
+    # Ring 0-1-2-3 with a tail 3-4-5 and a separate bond 6-7
+    bonds = np.array([[0, 1], [1, 2], [2, 3], [3, 0], [3, 4], [4, 5], [6, 7]])
+    assert bridges(8, bonds).tolist() == [False] * 4 + [True] * 3
+    # Two bonds between the same atoms form a ring
+    assert not bridges(2, np.array([[0, 1], [1, 0]])).any()
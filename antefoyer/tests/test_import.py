@@ -0,0 +1,74 @@
+"""
+Import-time budget for the antefoyer package.
+"""
+
+import subprocess
+import sys
+
+# Cumulative import time of the package, in microseconds. Generous
+# so that slow CI machines pass, but far below the cost of importing
+# parmed or foyer.
+IMPORT_BUDGET_US = 100000
+
+HEAVY_MODULES = ["numpy", "parmed", "networkx", "foyer", "mbuild", "pkg_resources"]
+
+
+def _import_times(statement):
+    """Cumulative import time of each module imported by statement."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_is_lazy():
+    times = _import_times("import antefoyer")
+    for module in HEAVY_MODULES:
+        assert module not in times
+
+
+def test_import_time_budget():
+    times = _import_times("import antefoyer")
+    assert times["antefoyer"] < IMPORT_BUDGET_US
+
+
+def test_plugin_import_is_lazy():
+    # foyer imports this module to find the bundled force fields
+    times = _import_times("import antefoyer.gafffoyer")
+    for module in HEAVY_MODULES:
+        assert module not in times
+
+
+def test_lazy_attributes():
+    import antefoyer
+
+    assert callable(antefoyer.ante_charges)
+    assert isinstance(antefoyer.__version__, str)
+    assert "ante_atomtyping" in dir(antefoyer)
+
+
+def test_star_import():
+    namespace = {}
+    exec("from antefoyer import *", namespace)
+    assert callable(namespace["ante_charges"])
+    assert callable(namespace["ante_atomtyping"])
+    assert "ANTECHAMBER" in namespace
+
+
+def test_forwarded_attributes_are_current(monkeypatch):
+    import antefoyer
+    import antefoyer.antefoyer
+
+    antefoyer.ANTECHAMBER
+    monkeypatch.setattr(antefoyer.antefoyer, "ANTECHAMBER", "/opt/antechamber")
+    assert antefoyer.ANTECHAMBER == "/opt/antechamber"
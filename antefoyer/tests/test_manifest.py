@@ -0,0 +1,87 @@
+"""
+Tests for checkpointing batch runs to a manifest and resuming them.
+"""
+
+import numpy as np
+import pytest
+
+from antefoyer.antefoyer import ante_charges_batch
+from antefoyer.utils.manifest import open_manifest, read_manifest
+
+
+def test_read_manifest(tmp_path):
+    manifest = str(tmp_path / "manifest.jsonl")
+    assert read_manifest(manifest) == {}
+    with open(manifest, "w") as manifest_file:
+        manifest_file.write('{"key": "a", "index": 0, "charges": [0.1]}\n')
+        manifest_file.write('{"key": "b", "ind')
+
+    assert read_manifest(manifest) == {"a": [0.1]}
+    # The cut short line is terminated before new entries are added
+    with open_manifest(manifest) as manifest_file:
+        pass
+    with open(manifest) as manifest_file:
+        assert manifest_file.read().endswith("\n")
+
+
+def test_resume_from_manifest(fake_antechamber, ethanes, tmp_path):
+    molecules = ethanes(4)
+    manifest = str(tmp_path / "manifest.jsonl")
+
+    # The run is killed after two molecules, while writing the third
+    ante_charges_batch(molecules[:2], "bcc", manifest=manifest, cache_dir=False)
+    with open(manifest, "a") as manifest_file:
+        manifest_file.write('{"key": "cut sh')
+
+    # Only the remaining molecules are charged when resuming
+    fake_antechamber.setenv("ANTEFOYER_FAKE_FAILURE_RATE", "1")
+    results = ante_charges_batch(
+        molecules,
+        "bcc",
+        manifest=manifest,
+        return_exceptions=True,
+        return_structure=False,
+        cache_dir=False,
+    )
+    assert [isinstance(result, RuntimeError) for result in results] == [
+        False,
+        False,
+        True,
+        True,
+    ]
+    assert np.allclose(results[0], [atom.charge for atom in molecules[0].atoms])
+
+    fake_antechamber.delenv("ANTEFOYER_FAKE_FAILURE_RATE")
+    ante_charges_batch(molecules, "bcc", manifest=manifest, cache_dir=False)
+    with open(manifest) as manifest_file:
+        assert len(manifest_file.readlines()) == 5
+
+
+def test_manifest_keeps_chunk_results(fake_antechamber, ethanes, tmp_path):
+    molecules = ethanes(40)
+    manifest = str(tmp_path / "manifest.jsonl")
+
+    # Small molecules run in chunks of several, some of which fail
+    fake_antechamber.setenv("ANTEFOYER_FAKE_FAILURE_RATE", "0.1")
+    results = ante_charges_batch(
+        molecules,
+        "bcc",
+        n_procs=2,
+        use_threads=True,
+        return_exceptions=True,
+        cache_dir=False,
+    )
+    n_failed = sum(isinstance(result, RuntimeError) for result in results)
+    assert 0 < n_failed < len(molecules)
+
+    with pytest.raises(RuntimeError):
+        ante_charges_batch(
+            molecules,
+            "bcc",
+            n_procs=2,
+            use_threads=True,
+            manifest=manifest,
+            cache_dir=False,
+        )
+    with open(manifest) as manifest_file:
+        assert len(manifest_file.readlines()) == len(molecules) - n_failed
@@ -0,0 +1,68 @@
+"""
+Unit tests for the antefoyer mol2 reader.
+"""
+
+import numpy as np
+import parmed as pmd
+import pytest
+
+from foyer.tests.utils import get_fn
+
+from antefoyer.antefoyer import _read_charges
+from antefoyer.utils.mol2 import read_ac_atoms, read_mol2_atoms
+
+
+def test_read_mol2_atoms():
+    names, types, charges = read_mol2_atoms(get_fn("ethane.mol2"))
+    assert list(names) == ["C", "C", "H", "H", "H", "H", "H", "H"]
+    assert list(types) == ["c3", "c3", "hc", "hc", "hc", "hc", "hc", "hc"]
+    assert charges.dtype == float
+    assert np.allclose(charges[:2], -0.0941)
+    assert np.allclose(charges[2:], 0.0317)
+
+
+def test_read_mol2_invalid_atom(tmp_path):
+    mol2 = tmp_path / "bad.mol2"
+    mol2.write_text("@<TRIPOS>ATOM\n      1 C    0.0\n@<TRIPOS>BOND\n")
+    with pytest.raises(ValueError, match=r"Invalid atom record"):
+        read_mol2_atoms(str(mol2))
+
+
+def test_read_ac_atoms(tmp_path):
+    ac = tmp_path / "ethane.ac"
+    ac.write_text(
+        "CHARGE      0.00 ( 0 )\n"
+        "Formula: H6 C2\n"
+        "ATOM      1  C1  MOL     1    1003.537-101.423   0.000 -0.094100        c3\n"
+        "ATOM      2  H1  MOL     1       4.227   2.270   0.000  0.094100        hc\n"
+        "BOND    1    1    2    1     C1   H1\n"
+    )
+    names, types, charges = read_ac_atoms(str(ac))
+    assert list(names) == ["C1", "H1"]
+    assert list(types) == ["c3", "hc"]
+    assert np.allclose(charges, [-0.0941, 0.0941])
+
+
+def test_read_charges_elements():
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    charges = _read_charges(get_fn("ethane.mol2"), ethane)
+    assert np.allclose(charges, [atom.charge for atom in ethane.atoms])
+
+    # The output atoms must have the elements of the input atoms
+    mismatched = ethane.copy(pmd.Structure)
+    mismatched.atoms[0].atomic_number = 1
+    with pytest.raises(RuntimeError, match="does not match the molecule"):
+        _read_charges(get_fn("ethane.mol2"), mismatched)
+    with pytest.raises(RuntimeError, match="wrote 8 atoms"):
+        _read_charges(get_fn("ethane.mol2"), ethane[:7])
+
+
+def test_read_charges_numbered_names(tmp_path):
+    # PDB-style hydrogen names start with a digit
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    for idx, atom in enumerate(ethane.atoms[2:]):
+        atom.name = "{}HB".format(idx % 3 + 1)
+    mol2 = str(tmp_path / "ethane.mol2")
+    ethane.save(mol2)
+    charges = _read_charges(mol2, ethane)
+    assert len(charges) == len(ethane.atoms)
@@ -0,0 +1,106 @@
+"""
+Tests for reading multi-record SDF and mol2 files and streaming them
+through antechamber.
+"""
+
+import numpy as np
+import pytest
+
+from foyer.tests.utils import get_fn
+
+from antefoyer.antefoyer import ante_charges_stream
+from antefoyer.utils.molfile import file_format, iter_molecules
+
+# Acetate and methanol, the charge of acetate given in the property block
+ACETATE_METHANOL_SDF = """acetate
+  test
+
+  7  6  0  0  0  0  0  0  0  0999 V2000
+    0.0000    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0
+    1.5000    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0
+    2.1000    1.0000    0.0000 O   0  0  0  0  0  0  0  0  0  0  0  0
+    2.1000   -1.0000    0.0000 O   0  0  0  0  0  0  0  0  0  0  0  0
+   -0.4000    1.0000    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0
+   -0.4000   -0.5000    0.9000 H   0  0  0  0  0  0  0  0  0  0  0  0
+   -0.4000   -0.5000   -0.9000 H   0  0  0  0  0  0  0  0  0  0  0  0
+  1  2  1  0
+  2  3  2  0
+  2  4  1  0
+  1  5  1  0
+  1  6  1  0
+  1  7  1  0
+M  CHG  1   4  -1
+M  END
+$$$$
+methanol
+  test
+
+  6  5  0  0  0  0  0  0  0  0999 V2000
+    0.0000    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0
+    1.4000    0.0000    0.0000 O   0  0  0  0  0  0  0  0  0  0  0  0
+   -0.4000    1.0000    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0
+   -0.4000   -0.5000    0.9000 H   0  0  0  0  0  0  0  0  0  0  0  0
+   -0.4000   -0.5000   -0.9000 H   0  0  0  0  0  0  0  0  0  0  0  0
+    1.7000    0.9000    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0
+  1  2  1  0
+  1  3  1  0
+  1  4  1  0
+  1  5  1  0
+  2  6  1  0
+M  END
+$$$$
+"""
+
+
+def test_file_format():
+    assert file_format("library.SDF") == "sdf"
+    assert file_format("library.mol2") == "mol2"
+    with pytest.raises(ValueError, match="Unknown molecule file format"):
+        file_format("library.pdb")
+
+
+def test_iter_sdf(tmp_path):
+    sdf = tmp_path / "library.sdf"
+    sdf.write_text(ACETATE_METHANOL_SDF)
+    acetate, methanol = iter_molecules(str(sdf))
+
+    assert acetate.title == "acetate"
+    assert [atom.element for atom in acetate.atoms] == [6, 6, 8, 8, 1, 1, 1]
+    assert [atom.formal_charge for atom in acetate.atoms] == [0, 0, 0, -1, 0, 0, 0]
+    assert [bond.order for bond in acetate.bonds] == [1.0, 2.0, 1.0, 1.0, 1.0, 1.0]
+    assert acetate.atoms[1].xx == pytest.approx(1.5)
+    assert len(methanol.atoms) == 6
+    assert len(methanol.bonds) == 5
+
+
+def test_iter_mol2(tmp_path):
+    with open(get_fn("ethane.mol2")) as mol2:
+        record = mol2.read()
+    library = tmp_path / "library.mol2"
+    library.write_text("# comment\n" + record + record)
+
+    molecules = list(iter_molecules(str(library)))
+    assert [len(molecule.atoms) for molecule in molecules] == [8, 8]
+    assert molecules[0].title == record.splitlines()[1].strip()
+
+
+def test_charges_stream(fake_antechamber, ethane, tmp_path):
+    library = str(tmp_path / "library.mol2")
+    with open(get_fn("ethane.mol2")) as mol2:
+        record = mol2.read()
+    with open(library, "w") as mol2:
+        mol2.write(record * 5)
+
+    results = ante_charges_stream(
+        library, "bcc", n_procs=2, window=3, ordered=True, cache_dir=False
+    )
+    indices = []
+    for idx, molecule in results:
+        indices.append(idx)
+        assert np.allclose(molecule.atoms[0].charge, -0.135, atol=0.001)
+    assert indices == [0, 1, 2, 3, 4]
+
+    output = str(tmp_path / "charged.mol2")
+    assert ante_charges_stream(library, "bcc", output=output, cache_dir=False) == 5
+    with open(output) as mol2:
+        assert mol2.read().count("@<TRIPOS>MOLECULE") == 5
@@ -0,0 +1,58 @@
+"""
+Tests for the batch scheduler and its cost model.
+"""
+
+import numpy as np
+import pytest
+
+from antefoyer.antefoyer import ante_charges_batch
+from antefoyer.utils.schedule import estimate_costs, load_timings
+from antefoyer.utils.schedule import lpt_chunks, record_timings
+
+
+def test_lpt_chunks():
+    costs = [1.0, 50.0, 0.1, 0.1, 20.0, 0.1, 0.1]
+    chunks = lpt_chunks(costs, n_workers=2)
+    # The large jobs start first, the small ones share a chunk
+    assert chunks == [[1], [4], [0, 2, 3, 5, 6]]
+
+
+def test_estimate_costs():
+    costs = estimate_costs({}, "bcc", [8, 20, 100], [2, 6, 40])
+    assert np.all(np.diff(costs) > 0)
+    assert estimate_costs({}, "gas", [100], [40])[0] < costs[2]
+
+    # Timings of a machine where every run takes 1 s plus 0.01 s per size unit
+    runs = [(n, n, 1.0 + 0.01 * n ** 2.5) for n in (5, 10, 20, 40, 80)]
+    timings = {"bcc": [list(run) for run in runs]}
+    assert np.allclose(estimate_costs(timings, "bcc", [10, 80], [10, 80]), [
+        runs[1][2], runs[4][2]
+    ])
+
+
+def test_record_timings(tmpdir):
+    cache_dir = str(tmpdir)
+    timings = load_timings(cache_dir)
+    assert timings == {}
+    record_timings(timings, "bcc", [(8, 2, 0.5)], cache_dir)
+    assert load_timings(cache_dir) == {"bcc": [[8, 2, 0.5]]}
+
+
+@pytest.mark.parametrize("use_threads", [True, False])
+def test_scheduled_batch(fake_antechamber, ethanes, tmpdir, use_threads):
+    molecules = ethanes(4)
+
+    cache_dir = str(tmpdir)
+    charged = ante_charges_batch(
+        molecules, "bcc", n_procs=2, use_threads=use_threads, cache_dir=cache_dir
+    )
+    assert [molecule.coordinates[0, 0] for molecule in charged] == [
+        molecule.coordinates[0, 0] for molecule in molecules
+    ]
+    assert len(load_timings(cache_dir)["bcc"]) == 4
+
+    # Cached results do not add timings
+    ante_charges_batch(
+        molecules, "bcc", n_procs=2, use_threads=use_threads, cache_dir=cache_dir
+    )
+    assert len(load_timings(cache_dir)["bcc"]) == 4
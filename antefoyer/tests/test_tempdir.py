@@ -0,0 +1,81 @@
+"""
+Unit tests for the antefoyer scratch directories.
+"""
+
+import os
+
+import pytest
+
+from antefoyer.utils.tempdir import configure_scratch, get_scratch_config
+from antefoyer.utils.tempdir import scratch_directory
+
+
+@pytest.fixture
+def reset_scratch():
+    yield
+    configure_scratch()
+
+
+def test_scratch_root(tmp_path, reset_scratch):
+    configure_scratch(root=str(tmp_path))
+    with scratch_directory() as tmpdir:
+        assert os.path.dirname(tmpdir) == str(tmp_path)
+    assert not os.path.exists(tmpdir)
+
+
+def test_scratch_pool_reuse(tmp_path, reset_scratch):
+    configure_scratch(root=str(tmp_path), pool_size=1)
+    with scratch_directory() as first:
+        with open(os.path.join(first, "sqm.out"), "w") as sqm_out:
+            sqm_out.write("junk")
+    with scratch_directory() as second:
+        assert second == first
+        assert os.listdir(second) == []
+    configure_scratch()
+    assert not os.path.exists(first)
+
+
+def test_scratch_keep_on_failure(tmp_path, reset_scratch):
+    configure_scratch(root=str(tmp_path), keep_on_failure=True)
+    with pytest.warns(UserWarning, match=r"Keeping scratch directory"):
+        with pytest.raises(RuntimeError):
+            with scratch_directory() as tmpdir:
+                raise RuntimeError("Antechamber failed")
+    assert os.path.isdir(tmpdir)
+
+
+def test_scratch_config(reset_scratch):
+    configure_scratch(remove_intermediates=True)
+    assert get_scratch_config()["remove_intermediates"]
+    configure_scratch()
+    assert not get_scratch_config()["remove_intermediates"]
+
+
+def test_scratch_config_in_spawned_workers(
+    fake_antechamber, ethanes, tmp_path, reset_scratch
+):
+    from functools import partial
+    from multiprocessing import get_context
+
+    import antefoyer.antefoyer
+
+    # Spawned workers see neither the environment variable nor the
+    # module state of this process unless it is passed to them
+    fake_antechamber.delenv("ANTEFOYER_ANTECHAMBER")
+    fake_antechamber.setenv("ANTEFOYER_FAKE_FAILURE", "fatal")
+    scratch = tmp_path / "scratch"
+    configure_scratch(root=str(scratch), keep_on_failure=True)
+
+    charges = partial(
+        antefoyer.antefoyer.ante_charges, charge_style="bcc", cache_dir=False
+    )
+    results = antefoyer.antefoyer._run_batch(
+        charges,
+        [(molecule,) for molecule in ethanes(2)],
+        2,
+        return_exceptions=True,
+        mp_context=get_context("spawn"),
+    )
+    assert all("Antechamber failed" in str(result) for result in results)
+    # The failed runs kept their scratch directories under the root
+    assert len(os.listdir(str(scratch))) == 2
@@ -0,0 +1,59 @@
+"""
+Tests for the timing instrumentation of the antechamber pipeline.
+"""
+
+import logging
+
+import parmed as pmd
+import pytest
+
+from foyer.tests.utils import get_fn
+
+from antefoyer.antefoyer import ANTECHAMBER, ante_charges
+from antefoyer.utils.timing import add_timing_callback, remove_timing_callback, timed
+
+
+@pytest.fixture
+def records():
+    records = []
+    add_timing_callback(records.append)
+    yield records
+    remove_timing_callback(records.append)
+
+
+def test_timed(records):
+    with timed("stage", size=3):
+        pass
+    with pytest.raises(KeyError):
+        with timed("failing"):
+            raise KeyError
+
+    assert [record["stage"] for record in records] == ["stage", "failing"]
+    assert records[0]["size"] == 3
+    assert records[0]["seconds"] >= 0.0
+    assert records[0]["error"] is None
+    assert records[1]["error"] == "KeyError"
+
+
+def test_timed_logging(caplog):
+    with caplog.at_level(logging.DEBUG, logger="antefoyer.timing"):
+        with timed("stage"):
+            pass
+    assert caplog.records[0].stage == "stage"
+    assert caplog.records[0].seconds >= 0.0
+
+
+@pytest.mark.skipif(ANTECHAMBER is None, reason="antechamber is not installed")
+def test_pipeline_stages(records):
+    ethane = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+    ante_charges(ethane, "bcc", cache_dir=False)
+    stages = [record["stage"] for record in records]
+    assert stages == [
+        "check_structure",
+        "check_single_molecule",
+        "write_input",
+        "antechamber",
+        "read_output",
+        "ante_charges",
+    ]
+    assert records[3]["program"] == "antechamber"
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+CACHE_DIR_ENV = "ANTEFOYER_CACHE_DIR"
+
+
+def get_cache_dir(cache_dir=None):
+    """Resolve the directory used to cache antechamber results.
+
+    Parameters
+    ----------
+    cache_dir : str or bool, optional, default=None
+        Directory to cache results in. If None, the directory is
+        taken from the ANTEFOYER_CACHE_DIR environment variable.
+        If False, or if no directory is configured, caching is
+        disabled.
+
+    Returns
+    -------
+    cache_dir : str or None
+        Absolute path to the cache directory, or None if caching
+        is disabled
+    """
+    if cache_dir is False:
+        return None
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if not cache_dir:
+        return None
+    return os.path.abspath(os.path.expanduser(cache_dir))
+
+
+def cache_key(**fields):
+    """Hash the fields that determine an antechamber result.
+
+    The fields must be JSON serializable. The key does not depend
+    on the order in which the fields are passed.
+    """
+    content = json.dumps(fields, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def cache_path(cache_dir, key, ext="mol2"):
+    """Location of the cache entry with the given key."""
+    return os.path.join(cache_dir, key[:2], "{}.{}".format(key, ext))
+
+
+def load_cached(cache_dir, key, ext="mol2"):
+    """Return the path of a cached result, or None on a cache miss."""
+    path = cache_path(cache_dir, key, ext)
+    if os.path.isfile(path):
+        return path
+    return None
+
+
+def store_cached(cache_dir, key, filename, ext="mol2"):
+    """Copy filename into the cache under key.
+
+    The file is copied to a temporary name and then renamed, so
+    concurrent readers never see a partially written entry.
+    """
+    path = cache_path(cache_dir, key, ext)
+    entry_dir = os.path.dirname(path)
+    os.makedirs(entry_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(filename, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+def load_metadata(cache_dir, name):
+    """Read a small JSON document stored in the cache directory."""
+    path = os.path.join(cache_dir, name + ".json")
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def store_metadata(cache_dir, name, data):
+    """Atomically write a small JSON document to the cache directory."""
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as json_file:
+            json.dump(data, json_file, sort_keys=True)
+        os.replace(tmp_path, os.path.join(cache_dir, name + ".json"))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,220 @@
+from collections import OrderedDict
+
+import numpy as np
+import parmed as pmd
+
+from antefoyer.utils.graph import bond_array, bridges, component_atoms
+from antefoyer.utils.graph import component_bonds, connected_components
+
+# Length in Angstrom of a bond from an element to a hydrogen cap
+_CAP_BOND_LENGTHS = {6: 1.09, 7: 1.01, 8: 0.96, 16: 1.34}
+_DEFAULT_CAP_BOND_LENGTH = 1.09
+
+
+def cuttable_bonds(molecule, bonds=None):
+    """Find the bonds a molecule may be cut at for fragment charging.
+
+    A bond may be cut if it is a single bond outside of any ring
+    between two heavy atoms that are each bonded to at least one
+    other heavy atom, and at least one of them is a tetravalent
+    (sp3) carbon. Cutting there leaves no conjugated system split
+    and no fragment that is a bare hydride.
+
+    Parameters
+    ----------
+    molecule : parmed.Structure
+        Single molecule
+    bonds : np.ndarray of int, shape=(n_bonds, 2), optional
+        Bond array of the molecule, see `bond_array`
+
+    Returns
+    -------
+    cuttable : np.ndarray of bool, shape=(n_bonds,)
+    """
+    if bonds is None:
+        bonds = bond_array(molecule)
+    n_atoms = len(molecule.atoms)
+    elements = np.array([atom.element for atom in molecule.atoms], dtype=int)
+    orders = np.array([bond.order for bond in molecule.bonds], dtype=float)
+    atom1, atom2 = bonds[:, 0], bonds[:, 1]
+
+    heavy = elements > 1
+    degree = np.bincount(bonds.ravel(), minlength=n_atoms)
+    heavy_degree = np.bincount(atom1[heavy[atom2]], minlength=n_atoms) + np.bincount(
+        atom2[heavy[atom1]], minlength=n_atoms
+    )
+    sp3_carbon = (elements == 6) & (degree == 4)
+
+    return (
+        bridges(n_atoms, bonds)
+        & (orders == 1.0)
+        & heavy[atom1]
+        & heavy[atom2]
+        & (heavy_degree[atom1] > 1)
+        & (heavy_degree[atom2] > 1)
+        & (sp3_carbon[atom1] | sp3_carbon[atom2])
+    )
+
+
+def partition(molecule, max_atoms):
+    """Cut a molecule into fragments of at most max_atoms atoms.
+
+    The molecule is first cut at every cuttable bond (see
+    `cuttable_bonds`). Neighboring pieces are then joined again,
+    smallest pairs first, as long as the joined fragment including
+    its hydrogen caps stays within max_atoms. A piece that is larger
+    than max_atoms on its own is kept whole.
+
+    Parameters
+    ----------
+    molecule : parmed.Structure
+        Single molecule
+    max_atoms : int
+        Maximum number of atoms of a fragment, including caps
+
+    Returns
+    -------
+    labels : np.ndarray of int, shape=(n_atoms,)
+        Fragment of each atom, numbered in order of the lowest atom
+        index of the fragment
+    cut_bonds : np.ndarray of int, shape=(n_cut, 2)
+        Atom indices of the bonds that were cut
+    """
+    n_atoms = len(molecule.atoms)
+    bonds = bond_array(molecule)
+    cuttable = cuttable_bonds(molecule, bonds)
+    n_pieces, piece = connected_components(n_atoms, bonds[~cuttable])
+
+    # Join pieces with a union-find over the cut bonds
+    parent = list(range(n_pieces))
+    size = np.bincount(piece, minlength=n_pieces).tolist()
+    caps = np.bincount(piece[bonds[cuttable].ravel()], minlength=n_pieces).tolist()
+
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    cut = piece[bonds[cuttable]]
+    order = np.argsort(np.asarray(size)[cut].sum(axis=1), kind="stable")
+    for piece1, piece2 in cut[order].tolist():
+        root1, root2 = find(piece1), find(piece2)
+        # The bond between the two pieces no longer needs two caps
+        joined_caps = caps[root1] + caps[root2] - 2
+        if size[root1] + size[root2] + joined_caps > max_atoms:
+            continue
+        root1, root2 = min(root1, root2), max(root1, root2)
+        parent[root2] = root1
+        size[root1] += size[root2]
+        caps[root1] = joined_caps
+
+    roots = np.array([find(idx) for idx in range(n_pieces)], dtype=np.intp)
+    _, labels = np.unique(roots[piece], return_inverse=True)
+    cut_bonds = bonds[labels[bonds[:, 0]] != labels[bonds[:, 1]]]
+    return labels, cut_bonds
+
+
+def repeat_units(molecule):
+    """Group the residues of a molecule into repeat units.
+
+    Two residues are copies of the same unit if their atoms (element
+    and formal charge), their bonds and their bonds to neighboring
+    residues are identical, with atoms compared in the order they
+    appear in the structure. End groups therefore form units of
+    their own.
+
+    Parameters
+    ----------
+    molecule : parmed.Structure
+        Single molecule
+
+    Returns
+    -------
+    units : list of (np.ndarray of int, list of np.ndarray of int)
+        For each unit in order of first appearance, the atom indices
+        of its first copy and of every copy (including the first)
+    cut_bonds : np.ndarray of int, shape=(n_cut, 2)
+        Atom indices of the bonds between residues
+    """
+    bonds = bond_array(molecule)
+    _, labels = np.unique(
+        [atom.residue.idx for atom in molecule.atoms], return_inverse=True
+    )
+    labels = labels.reshape(-1)
+    local_idx, local_bonds = component_bonds(labels, bonds)
+    cut_bonds = bonds[labels[bonds[:, 0]] != labels[bonds[:, 1]]]
+
+    # Bonds to neighboring residues, by local atom and outer element
+    links = [[] for _ in local_bonds]
+    for inner, outer in np.concatenate([cut_bonds, cut_bonds[:, ::-1]]).tolist():
+        links[labels[inner]].append(
+            (int(local_idx[inner]), molecule.atoms[outer].element)
+        )
+
+    units = OrderedDict()
+    for atom_indices, unit_bonds, unit_links in zip(
+        component_atoms(labels), local_bonds, links
+    ):
+        signature = (
+            tuple(
+                (molecule.atoms[atom_idx].element, molecule.atoms[atom_idx].formal_charge or 0)
+                for atom_idx in atom_indices.tolist()
+            ),
+            tuple(map(tuple, unit_bonds.tolist())),
+            tuple(sorted(unit_links)),
+        )
+        units.setdefault(signature, []).append(atom_indices)
+
+    return [(copies[0], copies) for copies in units.values()], cut_bonds
+
+
+def capped_fragment(molecule, atom_indices, cut_bonds):
+    """Extract a fragment and cap each cut bond with a hydrogen.
+
+    The cap is placed on the cut bond, at the length of a bond
+    between the fragment atom and a hydrogen.
+
+    Parameters
+    ----------
+    molecule : parmed.Structure
+        Molecule the fragment is cut from
+    atom_indices : sequence of int
+        Atoms of the fragment, in ascending order
+    cut_bonds : np.ndarray of int, shape=(n_cut, 2)
+        Cut bonds of the molecule, see `partition`
+
+    Returns
+    -------
+    fragment : parmed.Structure
+        The fragment atoms in the order of atom_indices, followed
+        by the caps
+    capped : np.ndarray of int
+        For each cap, the index in the fragment of the atom it
+        is bonded to
+    """
+    atom_indices = np.asarray(atom_indices, dtype=np.intp)
+    fragment = molecule[atom_indices.tolist()]
+    local_idx = {atom_idx: local for local, atom_idx in enumerate(atom_indices.tolist())}
+
+    capped = []
+    for atom1, atom2 in cut_bonds.tolist():
+        if atom1 not in local_idx:
+            atom1, atom2 = atom2, atom1
+        if atom1 not in local_idx:
+            continue
+        inner = molecule.atoms[atom1]
+        outer = molecule.atoms[atom2]
+        start = np.array([inner.xx, inner.xy, inner.xz])
+        direction = np.array([outer.xx, outer.xy, outer.xz]) - start
+        length = _CAP_BOND_LENGTHS.get(inner.element, _DEFAULT_CAP_BOND_LENGTH)
+        position = start + direction * (length / np.linalg.norm(direction))
+
+        anchor = fragment.atoms[local_idx[atom1]]
+        cap = pmd.Atom(name="HX", atomic_number=1)
+        fragment.add_atom(cap, anchor.residue.name, anchor.residue.number)
+        cap.xx, cap.xy, cap.xz = position.tolist()
+        fragment.bonds.append(pmd.Bond(anchor, cap))
+        capped.append(local_idx[atom1])
+
+    return fragment, np.array(capped, dtype=np.intp)
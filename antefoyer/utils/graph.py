@@ -0,0 +1,184 @@
+import numpy as np
+
+
+def bond_array(molecule):
+    """Atom indices of the bonds of a parmed.Structure.
+
+    Returns
+    -------
+    bonds : np.ndarray of int, shape=(n_bonds, 2)
+    """
+    bonds = molecule.bonds
+    flat = np.fromiter(
+        (idx for bond in bonds for idx in (bond.atom1.idx, bond.atom2.idx)),
+        dtype=np.intp,
+        count=2 * len(bonds),
+    )
+    return flat.reshape(-1, 2)
+
+
+def connected_components(n_atoms, bonds):
+    """Find the connected components of a bond graph.
+
+    Components are found by hooking the root of every bond's larger
+    end onto the root of its smaller end and compressing the trees
+    by pointer jumping, on whole arrays at a time. The root of each
+    component is its lowest atom index.
+
+    Parameters
+    ----------
+    n_atoms : int
+        Number of atoms
+    bonds : np.ndarray of int, shape=(n_bonds, 2)
+        Atom indices of the bonds
+
+    Returns
+    -------
+    n_components : int
+        Number of connected components
+    labels : np.ndarray of int, shape=(n_atoms,)
+        Component of each atom. Components are numbered in order of
+        their lowest atom index.
+    """
+    bonds = np.asarray(bonds, dtype=np.intp).reshape(-1, 2)
+    parent = np.arange(n_atoms, dtype=np.intp)
+    atom1, atom2 = bonds[:, 0], bonds[:, 1]
+    while True:
+        root1 = parent[atom1]
+        root2 = parent[atom2]
+        unmerged = root1 != root2
+        if not unmerged.any():
+            break
+        root1 = root1[unmerged]
+        root2 = root2[unmerged]
+        np.minimum.at(
+            parent, np.maximum(root1, root2), np.minimum(root1, root2)
+        )
+        # Point every atom directly at its root
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+    roots, labels = np.unique(parent, return_inverse=True)
+    return len(roots), labels
+
+
+def component_atoms(labels):
+    """Atom indices of each component, in ascending order.
+
+    Parameters
+    ----------
+    labels : np.ndarray of int, shape=(n_atoms,)
+        Component labels as returned by `connected_components`
+
+    Returns
+    -------
+    components : list of np.ndarray of int
+    """
+    if len(labels) == 0:
+        return []
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels)
+    return np.split(order, np.cumsum(counts)[:-1])
+
+
+def component_bonds(labels, bonds):
+    """Bonds of each component, in local atom indices.
+
+    Parameters
+    ----------
+    labels : np.ndarray of int, shape=(n_atoms,)
+        Component labels as returned by `connected_components`
+    bonds : np.ndarray of int, shape=(n_bonds, 2)
+        Atom indices of the bonds. Bonds between components are
+        ignored.
+
+    Returns
+    -------
+    local_idx : np.ndarray of int, shape=(n_atoms,)
+        Index of each atom within its component
+    bonds : list of np.ndarray of int, shape=(n_component_bonds, 2)
+        For each component, its bonds in local atom indices, with
+        the lower index first and sorted
+    """
+    counts = np.bincount(labels)
+    local_idx = np.empty(len(labels), dtype=np.intp)
+    if len(labels):
+        local_idx[np.argsort(labels, kind="stable")] = np.arange(
+            len(labels)
+        ) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    bonds = np.asarray(bonds, dtype=np.intp).reshape(-1, 2)
+    bonds = bonds[labels[bonds[:, 0]] == labels[bonds[:, 1]]]
+    local_bonds = np.sort(local_idx[bonds], axis=1)
+    bond_component = labels[bonds[:, 0]]
+    order = np.lexsort((local_bonds[:, 1], local_bonds[:, 0], bond_component))
+    bond_counts = np.bincount(bond_component, minlength=len(counts))
+    return local_idx, np.split(local_bonds[order], np.cumsum(bond_counts)[:-1])
+
+
+def bridges(n_atoms, bonds):
+    """Find the bonds that are not part of any ring.
+
+    These are the bridges of the bond graph: removing one splits its
+    molecule in two. They are found by a depth-first search that
+    tracks the earliest atom reachable from each subtree.
+
+    Parameters
+    ----------
+    n_atoms : int
+        Number of atoms
+    bonds : np.ndarray of int, shape=(n_bonds, 2)
+        Atom indices of the bonds
+
+    Returns
+    -------
+    is_bridge : np.ndarray of bool, shape=(n_bonds,)
+    """
+    bonds = np.asarray(bonds, dtype=np.intp).reshape(-1, 2)
+    n_bonds = len(bonds)
+
+    # Neighbors of each atom, and the bond to each, in CSR form
+    ends = np.concatenate([bonds[:, 0], bonds[:, 1]])
+    order = np.argsort(ends, kind="stable")
+    neighbors = np.concatenate([bonds[:, 1], bonds[:, 0]])[order].tolist()
+    via = np.tile(np.arange(n_bonds), 2)[order].tolist()
+    offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(ends, minlength=n_atoms))]
+    ).tolist()
+
+    is_bridge = np.zeros(n_bonds, dtype=bool)
+    discovered = [-1] * n_atoms
+    low = [0] * n_atoms
+    clock = 0
+    for root in range(n_atoms):
+        if discovered[root] >= 0:
+            continue
+        discovered[root] = low[root] = clock
+        clock += 1
+        # Entries are (atom, bond to its parent, next neighbor position)
+        stack = [(root, -1, offsets[root])]
+        while stack:
+            atom, parent_bond, pos = stack[-1]
+            if pos < offsets[atom + 1]:
+                stack[-1] = (atom, parent_bond, pos + 1)
+                if via[pos] == parent_bond:
+                    continue
+                neighbor = neighbors[pos]
+                if discovered[neighbor] < 0:
+                    discovered[neighbor] = low[neighbor] = clock
+                    clock += 1
+                    stack.append((neighbor, via[pos], offsets[neighbor]))
+                elif discovered[neighbor] < low[atom]:
+                    low[atom] = discovered[neighbor]
+                continue
+            stack.pop()
+            if stack:
+                parent = stack[-1][0]
+                if low[atom] < low[parent]:
+                    low[parent] = low[atom]
+                if low[atom] > discovered[parent]:
+                    is_bridge[parent_bond] = True
+    return is_bridge
@@ -0,0 +1,63 @@
+import json
+import os
+
+
+def read_manifest(path):
+    """Read the completed entries of a batch manifest.
+
+    The manifest is a JSON lines file with one entry per completed
+    molecule. A line that cannot be parsed, such as one cut short
+    when the process was killed while writing it, is ignored.
+
+    Parameters
+    ----------
+    path : str
+        Path of the manifest. A missing file has no entries.
+
+    Returns
+    -------
+    completed : dict
+        Charges of each completed entry, keyed by its job key
+    """
+    completed = {}
+    try:
+        manifest_file = open(path)
+    except FileNotFoundError:
+        return completed
+    with manifest_file:
+        for line in manifest_file:
+            try:
+                entry = json.loads(line)
+                completed[entry["key"]] = entry["charges"]
+            except (ValueError, KeyError, TypeError):
+                continue
+    return completed
+
+
+def open_manifest(path):
+    """Open a batch manifest for appending entries.
+
+    If the last line of an existing manifest was cut short, it is
+    terminated first so that the next entry starts on a line of its
+    own.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(manifest_dir, exist_ok=True)
+    manifest_file = open(path, "a+b")
+    manifest_file.seek(0, os.SEEK_END)
+    if manifest_file.tell() > 0:
+        manifest_file.seek(-1, os.SEEK_END)
+        if manifest_file.read(1) != b"\n":
+            manifest_file.write(b"\n")
+    return manifest_file
+
+
+def append_manifest(manifest_file, key, index, charges):
+    """Durably add a completed entry to a manifest opened with
+    `open_manifest`. The entry is on disk when this returns.
+    """
+    entry = {"key": key, "index": index, "charges": charges}
+    line = json.dumps(entry, separators=(",", ":")) + "\n"
+    manifest_file.write(line.encode("utf-8"))
+    manifest_file.flush()
+    os.fsync(manifest_file.fileno())
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def read_mol2_atoms(filename):
+    """Read the atom records of the first molecule in a mol2 file.
+
+    Only the @<TRIPOS>ATOM block is parsed; the file is read line by
+    line and reading stops at the end of the block.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the mol2 file
+
+    Returns
+    -------
+    names : np.ndarray of str
+        Atom names
+    types : np.ndarray of str
+        Atom types
+    charges : np.ndarray of float
+        Partial charges. Zero for atoms without a charge column.
+    """
+    names = []
+    types = []
+    charges = []
+    with open(filename) as mol2:
+        for line in mol2:
+            if line.startswith("@<TRIPOS>ATOM"):
+                break
+        for line in mol2:
+            if line.startswith("@<TRIPOS>"):
+                break
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) < 6:
+                raise ValueError(
+                    "Invalid atom record in {}: {}".format(filename, line.strip())
+                )
+            names.append(fields[1])
+            types.append(fields[5])
+            charges.append(float(fields[8]) if len(fields) > 8 else 0.0)
+
+    return np.array(names), np.array(types), np.array(charges, dtype=float)
+
+
+def read_ac_atoms(filename):
+    """Read the atom records of an antechamber .ac file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the .ac file
+
+    Returns
+    -------
+    names : np.ndarray of str
+        Atom names
+    types : np.ndarray of str
+        Atom types
+    charges : np.ndarray of float
+        Partial charges
+    """
+    names = []
+    types = []
+    charges = []
+    with open(filename) as ac:
+        for line in ac:
+            if line.startswith("ATOM"):
+                # Columns are fixed width; coordinates may run together
+                names.append(line[13:17].strip())
+                charges.append(float(line[54:64]))
+                types.append(line[64:].strip())
+    return np.array(names), np.array(types), np.array(charges, dtype=float)
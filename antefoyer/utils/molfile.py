@@ -0,0 +1,161 @@
+import io
+import os
+
+import parmed as pmd
+from parmed.formats.mol2 import Mol2File
+from parmed.periodic_table import AtomicNum
+
+# Formal charge of each charge code in the atom block of a V2000 molfile
+_SDF_CHARGE_CODES = {0: 0, 1: 3, 2: 2, 3: 1, 4: 0, 5: -1, 6: -2, 7: -3}
+# Bond order of each bond type of a V2000 molfile; 4 is aromatic
+_SDF_BOND_ORDERS = {1: 1.0, 2: 2.0, 3: 3.0, 4: 1.5}
+
+_FILE_FORMATS = {".sdf": "sdf", ".sd": "sdf", ".mol": "sdf", ".mol2": "mol2"}
+
+
+def file_format(filename):
+    """Format of a molecule file, 'sdf' or 'mol2', from its extension."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in _FILE_FORMATS:
+        raise ValueError(
+            "Unknown molecule file format: {}. Supported extensions "
+            "are: {}".format(filename, ", ".join(sorted(_FILE_FORMATS)))
+        )
+    return _FILE_FORMATS[ext]
+
+
+def iter_molecules(filename, input_format=None):
+    """Read the molecules of a multi-record SDF or mol2 file lazily.
+
+    The file is read record by record, so only one molecule is held
+    in memory at a time.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the file
+    input_format : str, optional, default=None
+        'sdf' or 'mol2'. If None, the format is taken from the file
+        extension.
+
+    Yields
+    ------
+    molecule : parmed.Structure
+        The molecules in file order, with the name of the record as
+        `title`. Atoms read from an SDF file
+        carry their formal charge (`atom.formal_charge`) and bonds
+        their bond order (`bond.order`, 1.5 for aromatic bonds).
+    """
+    if input_format is None:
+        input_format = file_format(filename)
+    if input_format == "sdf":
+        records, read_record = _sdf_records, _read_sdf_record
+    elif input_format == "mol2":
+        records, read_record = _mol2_records, _read_mol2_record
+    else:
+        raise ValueError("input_format must be 'sdf' or 'mol2'")
+
+    with open(filename) as molfile:
+        for lines in records(molfile):
+            yield read_record(lines)
+
+
+def _sdf_records(molfile):
+    """Split an open SDF file into the lines of each record."""
+    lines = []
+    for line in molfile:
+        if line.startswith("$$$$"):
+            yield lines
+            lines = []
+        else:
+            lines.append(line)
+    if any(line.strip() for line in lines):
+        yield lines
+
+
+def _mol2_records(molfile):
+    """Split an open mol2 file into the lines of each record.
+    Lines before the first record are skipped.
+    """
+    lines = None
+    for line in molfile:
+        if line.startswith("@<TRIPOS>MOLECULE"):
+            if lines:
+                yield lines
+            lines = []
+        if lines is not None:
+            lines.append(line)
+    if lines:
+        yield lines
+
+
+def _read_mol2_record(lines):
+    structure = Mol2File.parse(io.StringIO("".join(lines)), structure=True)
+    structure.title = lines[1].strip() if len(lines) > 1 else ""
+    return structure
+
+
+def _read_sdf_record(lines):
+    """Build a parmed.Structure from the lines of a V2000 molfile."""
+    title = lines[0].strip()
+    counts = lines[3]
+    if "V3000" in counts:
+        raise ValueError("V3000 molfiles are not supported: {}".format(title))
+    n_atoms, n_bonds = int(counts[0:3]), int(counts[3:6])
+
+    structure = pmd.Structure()
+    residue_name = title.split()[0] if title else "MOL"
+    element_counts = {}
+    for line in lines[4 : 4 + n_atoms]:
+        symbol = line[31:34].strip()
+        element_counts[symbol] = element_counts.get(symbol, 0) + 1
+        atom = pmd.Atom(
+            name="{}{}".format(symbol, element_counts[symbol])[:4],
+            atomic_number=AtomicNum.get(symbol, 0),
+        )
+        atom.formal_charge = _SDF_CHARGE_CODES.get(int(line[36:39].strip() or 0), 0)
+        structure.add_atom(atom, residue_name, 1)
+        atom.xx, atom.xy, atom.xz = (
+            float(line[0:10]),
+            float(line[10:20]),
+            float(line[20:30]),
+        )
+
+    for line in lines[4 + n_atoms : 4 + n_atoms + n_bonds]:
+        atom1, atom2 = int(line[0:3]) - 1, int(line[3:6]) - 1
+        structure.bonds.append(
+            pmd.Bond(
+                structure.atoms[atom1],
+                structure.atoms[atom2],
+                order=_SDF_BOND_ORDERS.get(int(line[6:9]), 1.0),
+            )
+        )
+
+    # Charges in the property block replace those of the atom block
+    charge_lines = [
+        line for line in lines[4 + n_atoms + n_bonds :] if line.startswith("M  CHG")
+    ]
+    if charge_lines:
+        for atom in structure.atoms:
+            atom.formal_charge = 0
+    for line in charge_lines:
+        fields = line[9:].split()
+        for atom_idx, charge in zip(fields[0::2], fields[1::2]):
+            structure.atoms[int(atom_idx) - 1].formal_charge = int(charge)
+
+    structure.title = title
+    return structure
+
+
+def write_mol2_record(molecule, molfile):
+    """Append a molecule as one record to an open mol2 file.
+
+    The record is named after the title of the molecule, if it has
+    one, and otherwise after its first residue.
+    """
+    record = io.StringIO()
+    Mol2File.write(molecule, record)
+    lines = record.getvalue().splitlines(True)
+    if molecule.title:
+        lines[1] = molecule.title + "\n"
+    molfile.write("".join(lines))
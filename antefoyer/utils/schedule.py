@@ -0,0 +1,170 @@
+import threading
+
+import numpy as np
+
+from antefoyer.utils.cache import load_metadata, store_metadata
+
+# Prior cost model per charge style: seconds = overhead + scale * size**exponent,
+# with size counting a hydrogen as a fraction of a heavy atom (see `job_size`).
+# sqm scales steeply with size; Gasteiger charges are nearly free.
+_PRIOR_COSTS = {
+    "bcc": (0.2, 2e-3, 2.5),
+    "mul": (0.2, 2e-3, 2.5),
+    "gas": (0.05, 1e-4, 1.0),
+}
+_DEFAULT_PRIOR = _PRIOR_COSTS["bcc"]
+
+# A hydrogen has one basis function in AM1, a heavy atom four
+_HYDROGEN_WEIGHT = 0.25
+
+# Timings kept per charge style, and needed before they replace the prior
+_MAX_TIMINGS = 256
+_MIN_TIMINGS = 5
+
+# Timings of this process, used when no cache directory is configured
+_TIMINGS = {}
+_TIMINGS_LOCK = threading.Lock()
+
+# Chunks of small jobs are filled up to this fraction of the work per worker
+_CHUNK_FRACTION = 0.25
+
+
+def job_size(n_atoms, n_heavy):
+    """Effective size of a molecule for the cost model."""
+    n_atoms = np.asarray(n_atoms, dtype=float)
+    n_heavy = np.asarray(n_heavy, dtype=float)
+    return n_heavy + _HYDROGEN_WEIGHT * (n_atoms - n_heavy)
+
+
+def load_timings(cache_dir=None):
+    """Load the antechamber timings recorded by earlier batches.
+
+    Parameters
+    ----------
+    cache_dir : str, optional, default=None
+        Cache directory the timings are stored in. If None, the
+        timings recorded by this process are used.
+
+    Returns
+    -------
+    timings : dict
+        For each charge style, a list of [n_atoms, n_heavy, seconds]
+    """
+    if cache_dir is None:
+        with _TIMINGS_LOCK:
+            return {style: list(runs) for style, runs in _TIMINGS.items()}
+    return load_metadata(cache_dir, "timings")
+
+
+def record_timings(timings, charge_style, runs, cache_dir=None):
+    """Add the timings of a batch and store them.
+
+    Parameters
+    ----------
+    timings : dict
+        Timings as returned by `load_timings`
+    charge_style : str
+        Charge style of the batch
+    runs : list of (int, int, float)
+        Number of atoms, number of heavy atoms and seconds spent in
+        antechamber for each timed molecule
+    cache_dir : str, optional, default=None
+        Cache directory to store the timings in. If None, they are
+        kept for the lifetime of the process.
+    """
+    if not runs:
+        return
+    history = timings.get(charge_style, []) + [list(run) for run in runs]
+    timings[charge_style] = history[-_MAX_TIMINGS:]
+    if cache_dir is None:
+        with _TIMINGS_LOCK:
+            _TIMINGS[charge_style] = timings[charge_style]
+    else:
+        store_metadata(cache_dir, "timings", timings)
+
+
+def estimate_costs(timings, charge_style, n_atoms, n_heavy):
+    """Estimate the seconds antechamber takes to charge molecules.
+
+    The estimate starts from a prior for the charge style and is
+    refit to the recorded timings once there are enough of them,
+    keeping the exponent of the prior.
+
+    Parameters
+    ----------
+    timings : dict
+        Timings as returned by `load_timings`
+    charge_style : str
+        Style of partial charges calculation
+    n_atoms, n_heavy : sequence of int
+        Number of atoms and of heavy atoms of each molecule
+
+    Returns
+    -------
+    costs : np.ndarray of float
+    """
+    overhead, scale, exponent = _fit(timings.get(charge_style, []), charge_style)
+    return overhead + scale * job_size(n_atoms, n_heavy) ** exponent
+
+
+def _fit(runs, charge_style):
+    """Fit overhead and scale of the cost model to recorded timings."""
+    prior = _PRIOR_COSTS.get(charge_style, _DEFAULT_PRIOR)
+    overhead, scale, exponent = prior
+    if len(runs) < _MIN_TIMINGS:
+        return prior
+    runs = np.asarray(runs, dtype=float)
+    growth = job_size(runs[:, 0], runs[:, 1]) ** exponent
+    seconds = runs[:, 2]
+
+    if np.ptp(growth) > 0:
+        design = np.column_stack([np.ones_like(growth), growth])
+        (overhead, scale), _, _, _ = np.linalg.lstsq(design, seconds, rcond=None)
+        if overhead >= 0 and scale > 0:
+            return overhead, scale, exponent
+    # Too little spread in size for two parameters: rescale the prior
+    ratio = np.median(seconds / (prior[0] + prior[1] * growth))
+    return prior[0] * ratio, prior[1] * ratio, exponent
+
+
+def lpt_chunks(costs, n_workers):
+    """Order jobs longest first and group small jobs into chunks.
+
+    Jobs are handed to the workers in the returned order, so the
+    most expensive jobs start first and the cheap ones fill the gaps
+    at the end (longest processing time first scheduling). Jobs
+    cheaper than a fraction of the work per worker are packed into
+    chunks of about that size, which are run by one worker in turn.
+
+    Parameters
+    ----------
+    costs : sequence of float
+        Estimated cost of each job
+    n_workers : int
+        Number of workers
+
+    Returns
+    -------
+    chunks : list of list of int
+        Job indices of each chunk, most expensive chunk first
+    """
+    costs = np.asarray(costs, dtype=float)
+    order = np.argsort(-costs, kind="stable").tolist()
+    target = _CHUNK_FRACTION * costs.sum() / max(n_workers, 1)
+
+    chunks = []
+    chunk, chunk_cost = [], 0.0
+    for idx in order:
+        if costs[idx] >= target:
+            chunks.append([idx])
+            continue
+        if chunk and chunk_cost + costs[idx] > target:
+            chunks.append(chunk)
+            chunk, chunk_cost = [], 0.0
+        chunk.append(idx)
+        chunk_cost += costs[idx]
+    if chunk:
+        chunks.append(chunk)
+
+    chunk_costs = np.array([costs[chunk].sum() for chunk in chunks])
+    return [chunks[idx] for idx in np.argsort(-chunk_costs, kind="stable")]
@@ -1,7 +1,22 @@
-
+import atexit
 import contextlib
+import os
 import tempfile
 import shutil
+import threading
+import warnings
+
+SCRATCH_ROOT_ENV = "ANTEFOYER_SCRATCH_ROOT"
+
+_SCRATCH_CONFIG = {
+    "root": None,
+    "pool_size": 0,
+    "keep_on_failure": False,
+    "remove_intermediates": False,
+}
+_SCRATCH_POOL = []
+_SCRATCH_POOL_PID = [os.getpid()]
+_SCRATCH_LOCK = threading.Lock()
 
 @contextlib.contextmanager
 def temporary_directory():
@@ -24,3 +39,136 @@ def temporary_cd(dir_path):
         os.chdir(prev_dir)
 
 
+def configure_scratch(
+    root=None, pool_size=0, keep_on_failure=False, remove_intermediates=False
+):
+    """Configure the scratch directories used for antechamber runs.
+
+    Parameters
+    ----------
+    root : str, optional, default=None
+        Directory in which scratch directories are created, e.g.,
+        '/dev/shm' for a memory-backed filesystem. If None, the
+        ANTEFOYER_SCRATCH_ROOT environment variable is used, and
+        otherwise the default temporary directory.
+    pool_size : int, optional, default=0
+        Number of scratch directories created up front and reused
+        across calls. Reused directories are emptied instead of
+        removed and recreated.
+    keep_on_failure : bool, optional, default=False
+        Keep the scratch directory of a failed run for debugging.
+        Its location is reported with a warning.
+    remove_intermediates : bool, optional, default=False
+        Ask antechamber to remove its intermediate files
+        (ANTECHAMBER_*, sqm.in, sqm.out, ATOMTYPE.INF, ...)
+    """
+    with _SCRATCH_LOCK:
+        _drain_pool()
+        _SCRATCH_CONFIG.update(
+            root=root,
+            pool_size=pool_size,
+            keep_on_failure=keep_on_failure,
+            remove_intermediates=remove_intermediates,
+        )
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+        for _ in range(pool_size):
+            _SCRATCH_POOL.append(_make_scratch_dir())
+
+
+def get_scratch_config():
+    """Return a copy of the current scratch configuration."""
+    return dict(_SCRATCH_CONFIG)
+
+
+def set_scratch_config(config):
+    """Apply a configuration returned by `get_scratch_config`, e.g.,
+    in a worker process. Pooled directories are created as runs
+    finish instead of up front.
+    """
+    with _SCRATCH_LOCK:
+        _drain_pool()
+        _SCRATCH_CONFIG.update(config)
+
+
+def scratch_root():
+    """Directory in which new scratch directories are created."""
+    return _SCRATCH_CONFIG["root"] or os.environ.get(SCRATCH_ROOT_ENV) or None
+
+
+@contextlib.contextmanager
+def scratch_directory():
+    """Provide an empty scratch directory for one antechamber run.
+
+    The directory is taken from the pool if one is configured and
+    returned to it afterwards. See `configure_scratch`.
+    """
+    tmp_dir = _acquire_scratch_dir()
+    try:
+        yield tmp_dir
+    except GeneratorExit:
+        _release_scratch_dir(tmp_dir)
+        raise
+    except BaseException:
+        if _SCRATCH_CONFIG["keep_on_failure"]:
+            warnings.warn("Keeping scratch directory of failed run: {}".format(tmp_dir))
+        else:
+            _release_scratch_dir(tmp_dir)
+        raise
+    else:
+        _release_scratch_dir(tmp_dir)
+
+
+def _make_scratch_dir():
+    return tempfile.mkdtemp(prefix="antefoyer_", dir=scratch_root())
+
+
+def _acquire_scratch_dir():
+    with _SCRATCH_LOCK:
+        # Pooled directories of a parent process are not ours to reuse
+        if _SCRATCH_POOL_PID[0] != os.getpid():
+            _SCRATCH_POOL[:] = []
+            _SCRATCH_POOL_PID[0] = os.getpid()
+        if _SCRATCH_POOL:
+            return _SCRATCH_POOL.pop()
+    return _make_scratch_dir()
+
+
+def _release_scratch_dir(tmp_dir):
+    with _SCRATCH_LOCK:
+        reuse = (
+            _SCRATCH_POOL_PID[0] == os.getpid()
+            and len(_SCRATCH_POOL) < _SCRATCH_CONFIG["pool_size"]
+        )
+    if reuse:
+        try:
+            _clear_directory(tmp_dir)
+        except OSError:
+            reuse = False
+    if not reuse:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    with _SCRATCH_LOCK:
+        _SCRATCH_POOL.append(tmp_dir)
+
+
+def _clear_directory(dir_path):
+    for entry in os.scandir(dir_path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.unlink(entry.path)
+
+
+def _drain_pool():
+    if _SCRATCH_POOL_PID[0] == os.getpid():
+        for tmp_dir in _SCRATCH_POOL:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    _SCRATCH_POOL[:] = []
+    _SCRATCH_POOL_PID[0] = os.getpid()
+
+
+@atexit.register
+def _cleanup_pool():
+    with _SCRATCH_LOCK:
+        _drain_pool()
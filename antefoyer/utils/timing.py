@@ -0,0 +1,68 @@
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger("antefoyer.timing")
+
+_CALLBACKS = []
+_CALLBACKS_LOCK = threading.Lock()
+
+
+def add_timing_callback(callback):
+    """Report the duration of each pipeline stage to callback.
+
+    The callback is called from the thread that ran the stage, with
+    one dict per finished stage:
+
+    - 'stage': name of the stage, e.g., 'check_structure',
+      'check_single_molecule', 'write_input', 'antechamber',
+      'read_output', or the name of the public function for the
+      whole call ('ante_atomtyping', 'ante_charges', ...)
+    - 'seconds': wall time spent in the stage
+    - 'error': name of the exception raised by the stage, or None
+    - stage specific fields, e.g., 'program' for 'antechamber'
+
+    Stage durations are also logged at DEBUG level to the
+    'antefoyer.timing' logger, with the same fields as attributes
+    of the log record.
+    """
+    with _CALLBACKS_LOCK:
+        _CALLBACKS.append(callback)
+
+
+def remove_timing_callback(callback):
+    """Stop reporting stage durations to callback."""
+    with _CALLBACKS_LOCK:
+        _CALLBACKS.remove(callback)
+
+
+@contextlib.contextmanager
+def timed(stage, **fields):
+    """Time a pipeline stage. Can be used as a context manager or as
+    a function decorator. Nothing is measured unless a callback is
+    registered or debug logging is enabled for 'antefoyer.timing'.
+    """
+    if not _CALLBACKS and not logger.isEnabledFor(logging.DEBUG):
+        yield
+        return
+
+    error = None
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as exc:
+        error = type(exc).__name__
+        raise
+    finally:
+        record = dict(fields, stage=stage, seconds=time.perf_counter() - start)
+        record["error"] = error
+        _report(record)
+
+
+def _report(record):
+    with _CALLBACKS_LOCK:
+        callbacks = list(_CALLBACKS)
+    for callback in callbacks:
+        callback(record)
+    logger.debug("%s: %.6f s", record["stage"], record["seconds"], extra=record)
@@ -0,0 +1,28 @@
+"""
+Synthetic molecules for the antefoyer benchmarks.
+"""
+
+import pytest
+
+from antefoyer.tests.conftest import polyethylene_chain
+
+pytest.importorskip("pytest_benchmark")
+
+# Number of atoms of the benchmark molecules, from ethane up to a
+# 10k atom polymer
+SIZES = [8, 101, 1001, 10001]
+
+
+_MOLECULES = {}
+
+
+@pytest.fixture(params=SIZES, ids=lambda size: "{}atoms".format(size))
+def molecule(request):
+    if request.param not in _MOLECULES:
+        _MOLECULES[request.param] = polyethylene_chain((request.param - 2) // 3)
+    return _MOLECULES[request.param]
+
+
+@pytest.fixture
+def ethane():
+    return polyethylene_chain(2)
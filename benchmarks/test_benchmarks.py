@@ -0,0 +1,107 @@
+"""
+Benchmarks of the antefoyer hot paths. See README.md.
+"""
+
+import os
+
+import pytest
+
+from antefoyer.antefoyer import ANTECHAMBER
+from antefoyer.antefoyer import _check_single_molecule, _check_structure
+from antefoyer.antefoyer import _apply_atom_types, _write_mol2, _write_pdb
+from antefoyer.antefoyer import ante_atomtyping, ante_charges, ante_charges_batch
+from antefoyer.gafffoyer import clear_forcefield_cache, compile_forcefield
+from antefoyer.gafffoyer import get_forcefield, load_GAFF
+from antefoyer.tests.conftest import polyethylene_chain
+from antefoyer.utils.mol2 import read_mol2_atoms
+
+requires_antechamber = pytest.mark.skipif(
+    ANTECHAMBER is None, reason="antechamber is not installed"
+)
+
+
+def test_write_pdb(benchmark, molecule, tmp_path):
+    benchmark(_write_pdb, molecule, str(tmp_path / "molecule.pdb"))
+
+
+def test_write_mol2(benchmark, molecule, tmp_path):
+    benchmark(_write_mol2, molecule, str(tmp_path / "molecule.mol2"))
+
+
+def test_check_single_molecule(benchmark, molecule):
+    benchmark(_check_single_molecule, molecule)
+
+
+def test_check_structure_mbuild(benchmark, molecule):
+    mb = pytest.importorskip("mbuild")
+    compound = mb.load(molecule)
+    benchmark(_check_structure, compound)
+
+
+def test_read_mol2_atoms(benchmark, molecule, tmp_path):
+    filename = str(tmp_path / "molecule.mol2")
+    _write_mol2(molecule, filename)
+    benchmark(read_mol2_atoms, filename)
+
+
+def test_apply_atom_types(benchmark, molecule, tmp_path):
+    filename = str(tmp_path / "molecule.mol2")
+    _write_mol2(molecule, filename)
+    names, types, charges = read_mol2_atoms(filename)
+    benchmark(_apply_atom_types, molecule, types)
+
+
+def test_load_gaff_parse(benchmark):
+    def parse():
+        clear_forcefield_cache()
+        return get_forcefield("gaff", compiled=False)
+
+    benchmark.pedantic(parse, rounds=3)
+
+
+def test_load_gaff_compiled(benchmark, tmp_path, monkeypatch):
+    monkeypatch.setenv("ANTEFOYER_FF_CACHE_DIR", str(tmp_path))
+    clear_forcefield_cache()
+    compile_forcefield("gaff")
+
+    def load():
+        clear_forcefield_cache()
+        return load_GAFF()
+
+    benchmark.pedantic(load, rounds=5)
+
+
+@requires_antechamber
+def test_atomtyping(benchmark, ethane):
+    benchmark.pedantic(
+        ante_atomtyping, args=(ethane, "gaff"), kwargs={"cache_dir": False}, rounds=3
+    )
+
+
+@requires_antechamber
+def test_charges(benchmark, ethane):
+    benchmark.pedantic(
+        ante_charges, args=(ethane, "bcc"), kwargs={"cache_dir": False}, rounds=3
+    )
+
+
+@requires_antechamber
+@pytest.mark.parametrize("use_threads", [False, True], ids=["processes", "threads"])
+def test_charges_batch(benchmark, use_threads):
+    molecules = [polyethylene_chain(2) for _ in range(os.cpu_count() or 1)]
+    benchmark.pedantic(
+        ante_charges_batch,
+        args=(molecules, "bcc"),
+        kwargs={"use_threads": use_threads, "cache_dir": False},
+        rounds=3,
+    )
+
+
+@requires_antechamber
+def test_atomtyping_template(benchmark, molecule):
+    benchmark.pedantic(
+        ante_atomtyping,
+        args=(molecule, "gaff"),
+        kwargs={"template": True, "cache_dir": False, "return_structure": False},
+        rounds=3,
+    )